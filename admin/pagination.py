@@ -0,0 +1,74 @@
+import base64
+import json
+from datetime import datetime
+
+from bson import ObjectId
+from flask import Response, stream_with_context
+
+EXPORT_BATCH_SIZE = 500
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+# Keyset cursors carry the sort value and _id of the last row on a page, so
+# the next page is an index range scan instead of a skip over earlier rows.
+def encode_cursor(sort_value, document_id):
+    payload = json.dumps({"v": sort_value.isoformat(), "id": str(document_id)})
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.fromisoformat(payload["v"]), ObjectId(payload["id"])
+    except Exception as e:
+        raise InvalidCursor(str(e))
+
+
+def keyset_match(field, cursor):
+    if not cursor:
+        return {}
+
+    sort_value, document_id = decode_cursor(cursor)
+    return {
+        "$or": [
+            {field: {"$lt": sort_value}},
+            {field: sort_value, "_id": {"$lt": document_id}}
+        ]
+    }
+
+
+def page_limit(value, default, maximum):
+    # Raises ValueError for anything that isn't an integer
+    limit = default if value is None else int(value)
+    return max(1, min(limit, maximum))
+
+
+def page_of(rows, limit, field):
+    # Pipelines fetch one row past the limit to learn whether more remain
+    has_more = bool(rows) and len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor(rows[-1][field], rows[-1]["_id"]) if has_more else None
+    return rows, next_cursor
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def ndjson_response(records, filename):
+    def lines():
+        for record in records:
+            yield json.dumps(record, default=_json_default) + "\n"
+
+    return Response(
+        stream_with_context(lines()),
+        mimetype="application/x-ndjson",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
@@ -1,24 +1,43 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt
-from pymongo import MongoClient
 from bson import ObjectId
-import os
-from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from embeddings.ingest_chunks import update_document_metadata
+from database.scope_versions import invalidate_document_scopes
+from embeddings.allowed_documents import allowed_documents
+from embeddings.embedding_cache import embedding_cache
+from llm.answer_cache import answer_cache
+from chat.summaries import conversation_summary_store
+from database.write_buffer import write_buffer
+from database.usage_counters import cached_stats, read_counters
+from documents.usage_rollups import usage_timeseries, usage_totals
+from admin.pagination import (
+    EXPORT_BATCH_SIZE,
+    InvalidCursor,
+    keyset_match,
+    ndjson_response,
+    page_limit,
+    page_of
+)
+from database.mongo import (
+    documents_collection,
+    messages_collection,
+    chat_sessions_collection,
+    users_collection,
+    user_usage
+)
 
-load_dotenv()
 
 admin_bp = Blueprint("admin", __name__)
 
-client = MongoClient(os.getenv("MONGO_URI"))
-db = client["KnowledgeAssistant"]
+MAX_PAGE_SIZE = 200
+
+# Default and maximum window per granularity
+TIMESERIES_RANGES = {
+    "hour": (timedelta(hours=48), timedelta(days=31)),
+    "day": (timedelta(days=30), timedelta(days=731))
+}
 
-documents_collection = db["documents"]
-messages_collection = db["messages"]
-chat_sessions_collection = db["chat_sessions"]
-users_collection = db["users"]
-llm_usage_logs = db["llm_usage_logs"]
-user_usage = db["user_usage"]
 
 
 def require_admin():
@@ -90,6 +109,13 @@ def toggle_document(document_id):
         {"$set": {"is_active": new_status, "updated_at": datetime.utcnow()}}
     )
 
+    try:
+        update_document_metadata(document_id, {"is_active": new_status})
+    except Exception as e:
+        print("Vector metadata update failed:", e)
+
+    invalidate_document_scopes(document["uploaded_by"])
+
     return jsonify({
         "success": True,
         "document_id": document_id,
@@ -105,45 +131,56 @@ def list_user_queries():
         return jsonify({"success": False, "msg": "Admin access required"}), 403
 
     user_id = request.args.get("user_id")
+    try:
+        limit = page_limit(request.args.get("limit"), 50, MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"success": False, "msg": "limit must be an integer"}), 400
+    export = request.args.get("format") == "ndjson"
 
     query_filter = {"role": "user"}
     if user_id:
         query_filter["user_id"] = ObjectId(user_id)
 
-    queries = list(
-        messages_collection.find(
-            query_filter,
-            {
-                "_id": 0,
-                "user_id": 1,
-                "session_id": 1,
-                "content": 1,
-                "created_at": 1
-            }
-        ).sort("created_at", -1)
-    )
+    try:
+        if not export:
+            query_filter.update(keyset_match("created_at", request.args.get("cursor")))
+    except InvalidCursor:
+        return jsonify({"success": False, "msg": "Invalid cursor"}), 400
 
-    user_ids = [
-        ObjectId(q["user_id"])
-        for q in queries
-        if ObjectId.is_valid(str(q["user_id"]))
+    pipeline = [
+        {"$match": query_filter},
+        {"$sort": {"created_at": -1, "_id": -1}},
+        *([] if export else [{"$limit": limit + 1}]),
+        {"$lookup": {
+            "from": users_collection.name,
+            "localField": "user_id",
+            "foreignField": "_id",
+            "as": "user"
+        }},
+        {"$project": {
+            "session_id": {"$toString": "$session_id"},
+            "content": 1,
+            "created_at": 1,
+            "user": {"$ifNull": [{"$first": "$user.username"}, "Unknown User"]}
+        }}
     ]
 
-    users = {
-        str(user["_id"]): user["username"]
-        for user in users_collection.find(
-            {"_id": {"$in": user_ids}},
-            {"username": 1}
+    cursor = messages_collection.aggregate(pipeline, batchSize=EXPORT_BATCH_SIZE, allowDiskUse=export)
+    if export:
+        return ndjson_response(
+            ({key: value for key, value in q.items() if key != "_id"} for q in cursor),
+            "queries.ndjson"
         )
-    }
 
+    queries, next_cursor = page_of(list(cursor), limit, "created_at")
     for q in queries:
-        uid = str(q["user_id"])
-        q["user"] = users.get(uid, "Unknown User")
-        q["session_id"] = str(q["session_id"])
-        del q["user_id"]
+        del q["_id"]
 
-    return jsonify({"success": True, "queries": queries}), 200
+    return jsonify({
+        "success": True,
+        "queries": queries,
+        "next_cursor": next_cursor
+    }), 200
 
 
 
@@ -153,65 +190,105 @@ def admin_conversations():
     if not require_admin():
         return jsonify({"success": False, "msg": "Admin access required"}), 403
 
-    page = int(request.args.get("page", 1))
-    limit = int(request.args.get("limit", 1))
+    try:
+        limit = page_limit(request.args.get("limit"), 1, MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"success": False, "msg": "limit must be an integer"}), 400
     user_id = request.args.get("user_id")
+    cursor_token = request.args.get("cursor")
+    export = request.args.get("format") == "ndjson"
 
     session_filter = {}
     if user_id and ObjectId.is_valid(user_id):
         session_filter["user_id"] = ObjectId(user_id)
 
-    skip = (page - 1) * limit
+    try:
+        page_filter = {} if export else keyset_match("updated_at", cursor_token)
+    except InvalidCursor:
+        return jsonify({"success": False, "msg": "Invalid cursor"}), 400
 
-    sessions = list(
-        chat_sessions_collection.find(
-            session_filter
-        )
-        .sort("updated_at", -1)
-        .skip(skip)
-        .limit(limit)
-    )
+    # Sessions, their usernames and their messages come back from one pipeline
+    pipeline = [
+        {"$match": {**session_filter, **page_filter}},
+        {"$sort": {"updated_at": -1, "_id": -1}},
+        *([] if export else [{"$limit": limit + 1}]),
+        {"$lookup": {
+            "from": users_collection.name,
+            "localField": "user_id",
+            "foreignField": "_id",
+            "as": "user"
+        }},
+        {"$lookup": {
+            "from": messages_collection.name,
+            "let": {"session_id": "$_id"},
+            "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$session_id", "$$session_id"]}}},
+                {"$sort": {"created_at": 1}},
+                {"$project": {"_id": 0, "role": 1, "content": 1, "created_at": 1}}
+            ],
+            "as": "messages"
+        }},
+        {"$project": {
+            "session_id": {"$toString": "$_id"},
+            "username": {"$ifNull": [{"$first": "$user.username"}, "Unknown User"]},
+            "created_at": 1,
+            "updated_at": 1,
+            "messages": 1
+        }}
+    ]
 
-    if not sessions:
-        return jsonify({"success": True, "sessions": [], "total": 0}), 200
+    cursor = chat_sessions_collection.aggregate(pipeline, batchSize=EXPORT_BATCH_SIZE, allowDiskUse=export)
+    if export:
+        return ndjson_response(
+            ({key: value for key, value in s.items() if key not in ("_id", "updated_at")} for s in cursor),
+            "conversations.ndjson"
+        )
 
-    user_ids = list({s["user_id"] for s in sessions})
+    sessions, next_cursor = page_of(list(cursor), limit, "updated_at")
+    for session in sessions:
+        del session["_id"]
+        del session["updated_at"]
 
-    users = {
-        str(u["_id"]): u["username"]
-        for u in users_collection.find(
-            {"_id": {"$in": user_ids}},
-            {"username": 1}
-        )
+    response = {
+        "success": True,
+        "sessions": sessions,
+        "next_cursor": next_cursor
     }
+    # Counting is only worth it once, when the first page is requested
+    if not cursor_token:
+        response["total"] = chat_sessions_collection.count_documents(session_filter)
 
-    response_sessions = []
-
-    for session in sessions:
-        messages = list(
-            messages_collection.find(
-                {"session_id": session["_id"]},
-                {"_id": 0, "role": 1, "content": 1, "created_at": 1}
-            ).sort("created_at", 1)
-        )
+    return jsonify(response), 200
 
-        response_sessions.append({
-            "session_id": str(session["_id"]),
-            "username": users.get(str(session["user_id"]), "Unknown User"),
-            "created_at": session["created_at"],
-            "messages": messages
-        })
 
-    total_sessions = chat_sessions_collection.count_documents(session_filter)
+@admin_bp.route("/caches", methods=["GET"])
+@jwt_required()
+def cache_stats():
+    if not require_admin():
+        return jsonify({"success": False, "msg": "Admin access required"}), 403
 
     return jsonify({
         "success": True,
-        "sessions": response_sessions,
-        "total": total_sessions,
-        "page": page
+        "caches": {
+            "allowed_documents": allowed_documents.stats(),
+            "answers": answer_cache.stats() if answer_cache is not None else None,
+            "embeddings": embedding_cache.stats() if embedding_cache is not None else None,
+            "conversation_summaries": (
+                conversation_summary_store.stats() if conversation_summary_store is not None else None
+            )
+        }
     }), 200
 
 
+@admin_bp.route("/write-buffer", methods=["GET"])
+@jwt_required()
+def write_buffer_stats():
+    if not require_admin():
+        return jsonify({"success": False, "msg": "Admin access required"}), 403
+
+    return jsonify({"success": True, "write_buffer": write_buffer.stats()}), 200
+
+
 @admin_bp.route("/usage", methods=["GET"])
 @jwt_required()
 def usage_stats():
@@ -219,22 +296,26 @@ def usage_stats():
         return jsonify({"success": False, "msg": "Admin access required"}), 403
 
     user_id = request.args.get("user_id")
+    if user_id and not ObjectId.is_valid(user_id):
+        return jsonify({"success": False, "msg": "Invalid user id"}), 400
+
+    # Unfiltered totals come from collection metadata, the rest from counters
+    # kept as sessions and messages are written; both are cached briefly.
+    def compute():
+        counters = read_counters(user_id)
+        return {
+            "total_users": users_collection.estimated_document_count() if not user_id else 1,
+            "total_documents": documents_collection.estimated_document_count(),
+            "total_chat_sessions": (
+                counters.get("chat_sessions", 0) if user_id
+                else chat_sessions_collection.estimated_document_count()
+            ),
+            "total_user_queries": counters.get("user_queries", 0),
+            "total_ai_responses": counters.get("ai_responses", 0),
+            "as_of": datetime.utcnow()
+        }
 
-    user_filter = {}
-    if user_id:
-        user_filter["user_id"] = ObjectId(user_id)
-
-    stats = {
-        "total_users": users_collection.count_documents({}) if not user_id else 1,
-        "total_documents": documents_collection.count_documents({}),
-        "total_chat_sessions": chat_sessions_collection.count_documents(user_filter),
-        "total_user_queries": messages_collection.count_documents(
-            {**user_filter, "role": "user"}
-        ),
-        "total_ai_responses": messages_collection.count_documents(
-            {**user_filter, "role": "assistant"}
-        )
-    }
+    stats = cached_stats(user_id or "global", compute)
 
     return jsonify({"success": True, "stats": stats}), 200
 
@@ -267,40 +348,78 @@ def llm_usage_summary():
     if not require_admin():
         return jsonify({"success": False, "msg": "Admin access required"}), 403
 
-    total_requests = llm_usage_logs.count_documents({})
-
-    pipeline = [
-        {
-            "$group": {
-                "_id": None,
-                "total_tokens": {"$sum": "$total_tokens"},
-                "total_cost": {"$sum": "$cost"}
-            }
-        }
-    ]
-
-    agg_result = list(llm_usage_logs.aggregate(pipeline))
-
-    if agg_result:
-        total_tokens = agg_result[0]["total_tokens"]
-        total_cost = round(agg_result[0]["total_cost"], 6)
-    else:
-        total_tokens = 0
-        total_cost = 0.0
+    totals = usage_totals()
 
+    total_requests = totals["requests"]
     active_users = user_usage.count_documents({})
 
     return jsonify({
         "success": True,
         "summary": {
-            "total_tokens": total_tokens,
-            "total_cost": total_cost,
+            "total_tokens": totals["total_tokens"],
+            "total_cost": round(totals["cost"], 6),
             "total_requests": total_requests,
-            "active_users": active_users
+            "active_users": active_users,
+            "cache_hits": totals["cache_hits"],
+            "cache_hit_rate": round(totals["cache_hits"] / total_requests, 4) if total_requests else 0.0,
+            "cost_saved": round(totals["cost_saved"], 6)
         }
     }), 200
 
 
+def _parse_utc(value):
+    # Stored times are naive UTC; "Z" and offsets are converted to match
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+@admin_bp.route("/llm-usage/timeseries", methods=["GET"])
+@jwt_required()
+def llm_usage_timeseries():
+    if not require_admin():
+        return jsonify({"success": False, "msg": "Admin access required"}), 403
+
+    granularity = request.args.get("granularity", "day")
+    group_by = request.args.get("group_by")
+    user_id = request.args.get("user_id")
+
+    if granularity not in TIMESERIES_RANGES:
+        return jsonify({"success": False, "msg": "granularity must be hour or day"}), 400
+    if group_by not in (None, "user_id", "model"):
+        return jsonify({"success": False, "msg": "group_by must be user_id or model"}), 400
+    if user_id and not ObjectId.is_valid(user_id):
+        return jsonify({"success": False, "msg": "Invalid user id"}), 400
+
+    default_range, max_range = TIMESERIES_RANGES[granularity]
+    try:
+        end = _parse_utc(request.args["end"]) if "end" in request.args else datetime.utcnow()
+        start = _parse_utc(request.args["start"]) if "start" in request.args else end - default_range
+    except ValueError:
+        return jsonify({"success": False, "msg": "start and end must be ISO 8601 UTC times"}), 400
+
+    if start >= end or end - start > max_range:
+        return jsonify({"success": False, "msg": f"Range must be positive and at most {max_range.days} days"}), 400
+
+    points = usage_timeseries(
+        granularity,
+        start,
+        end,
+        user_id=ObjectId(user_id) if user_id else None,
+        model=request.args.get("model"),
+        group_by=group_by
+    )
+
+    return jsonify({
+        "success": True,
+        "granularity": granularity,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "points": points
+    }), 200
+
+
 @admin_bp.route("/llm-usage/users", methods=["GET"])
 @jwt_required()
 def llm_usage_by_user():
@@ -322,6 +441,8 @@ def llm_usage_by_user():
             "username": users.get(uid, "Unknown User"),
             "total_tokens": u.get("total_tokens", 0),
             "total_cost": u.get("total_cost", 0),
+            "cache_hits": u.get("cache_hits", 0),
+            "cost_saved": u.get("cost_saved", 0),
             "last_used": u.get("last_used")
         })
 
@@ -6,27 +6,41 @@ from documents.routes import document_bp
 from datetime import timedelta
 from dotenv import load_dotenv
 load_dotenv()
+import socket
 import threading
-import time
-from embeddings.ingest_chunks import ingest_chunks
+from embeddings.worker import run_worker
 import os
 from chat.routes import chat_bp
 from admin.routes import admin_bp
+from monitoring.routes import metrics_bp, instrument_app
+from database.indexes import ensure_indexes_in_background, ENSURE_INDEXES
+from embeddings.lexical_index import lexical_index
+from documents.ingestion import recover_interrupted_jobs_in_background
 load_dotenv()
 import os
 
 
-def embedding_worker():
-    while True:
-        try:
-            ingest_chunks()
-        except Exception as e:
-            print("Embedding worker error:", e)
-        time.sleep(10)
+_embedding_worker = None
+
 
 def start_embedding_worker():
-    thread = threading.Thread(target=embedding_worker, daemon=True)
-    thread.start()
+    # Uploads in this process wake the worker directly, so no change stream is needed.
+    # Set EMBEDDING_WORKER=external when running `python -m embeddings.worker` instead.
+    global _embedding_worker
+    if _embedding_worker is not None:
+        return
+    _embedding_worker = threading.Thread(
+        target=run_worker,
+        args=(threading.Event(),),
+        kwargs={"owner": f"{socket.gethostname()}:{os.getpid()}:inline", "watch": False},
+        daemon=True
+    )
+    _embedding_worker.start()
+
+
+def in_reloader_parent(app):
+    # The dev reloader's parent only watches files; its child serves requests
+    return (app.debug or __name__ == "__main__") and os.environ.get("WERKZEUG_RUN_MAIN") != "true"
 
 def create_app():
     app=Flask(__name__)
@@ -40,8 +54,18 @@ def create_app():
     app.register_blueprint(document_bp,url_prefix="/document")
     app.register_blueprint(chat_bp,url_prefix="/chat")
     app.register_blueprint(admin_bp,url_prefix="/admin")
+    app.register_blueprint(metrics_bp)
+    instrument_app(app)
+
+    # Kept off startup so an unreachable MongoDB doesn't stall the app;
+    # deploys can also run `python -m database.indexes` once instead
+    if ENSURE_INDEXES:
+        ensure_indexes_in_background()
+
+    lexical_index.start()
+    recover_interrupted_jobs_in_background()
 
-    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+    if os.getenv("EMBEDDING_WORKER", "inline") == "inline" and not in_reloader_parent(app):
         start_embedding_worker()
     return app
 
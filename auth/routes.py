@@ -1,15 +1,12 @@
 from flask import Blueprint, request, jsonify
-from pymongo import MongoClient
 from auth.utils import hash_password, verify_password
 from flask_jwt_extended import create_access_token
 from users.model import create_user
-import os
+from database.mongo import users_collection
+from pymongo.errors import DuplicateKeyError
 
 
 auth_bp=Blueprint("auth",__name__)
-client=MongoClient(os.getenv("MONGO_URI"))
-db=client['KnowledgeAssistant']
-users_collection=db['users']
 
 
 @auth_bp.route('/register', methods=['POST'])
@@ -42,7 +39,14 @@ def register():
         role=data['role']
     )
 
-    users_collection.insert_one(user)
+    # The unique email index catches registrations racing past the check above
+    try:
+        users_collection.insert_one(user)
+    except DuplicateKeyError:
+        return jsonify({
+            "success":False,
+            "msg": "Email already registered"
+        }), 400
 
     return jsonify({
         "success":True,
@@ -0,0 +1,32 @@
+import argparse
+import os
+import time
+
+os.environ.setdefault("EMBED_BACKEND", "fake")
+os.environ.setdefault("EMBEDDING_CACHE_ENABLED", "false")
+
+from embeddings.embedder import embed_texts
+
+
+def run(num_chunks, batch_sizes, worker_counts):
+    texts = [f"benchmark chunk {i} " + "lorem ipsum " * 100 for i in range(num_chunks)]
+
+    for batch_size in batch_sizes:
+        for workers in worker_counts:
+            start = time.perf_counter()
+            embed_texts(texts, batch_size=batch_size, max_workers=workers)
+            elapsed = time.perf_counter() - start
+            print(
+                f"batch_size={batch_size:<4} workers={workers:<3} "
+                f"{num_chunks / elapsed:10.1f} chunks/sec"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Embedding throughput benchmark")
+    parser.add_argument("--chunks", type=int, default=1000)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32, 64])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    run(args.chunks, args.batch_sizes, args.workers)
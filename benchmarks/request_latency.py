@@ -0,0 +1,289 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+ENDPOINTS = ("ask", "ask_stream", "search", "upload")
+
+DOCUMENT = " ".join(
+    f"Sentence number {i} explains topic{i % 7} and how to resolve error ERR_{i}."
+    for i in range(400)
+)
+
+
+def configure_environment(args, data_dir):
+    os.environ.update({
+        "MONGO_URI": "mongodb://localhost:27017",
+        "VECTOR_BACKEND": "local",
+        "LOCAL_INDEX_PATH": os.path.join(data_dir, "vector_index"),
+        "EMBED_BACKEND": "fake",
+        "FAKE_EMBED_LATENCY_MS": str(args.embed_ms),
+        "EMBEDDING_CACHE_PATH": os.path.join(data_dir, "embeddings.sqlite3"),
+        "EXTRACTION_CACHE_DIR": os.path.join(data_dir, "extractions"),
+        "LLM_API": "benchmark",
+        "PINECONE_API_KEY": "benchmark"
+    })
+    # Repeated benchmark queries would otherwise be served from the caches
+    os.environ.setdefault("EMBEDDING_CACHE_ENABLED", "false")
+    os.environ.setdefault("ANSWER_CACHE_ENABLED", "false")
+
+
+def percentile(sorted_samples, q):
+    if not sorted_samples:
+        return None
+    rank = max(0, min(len(sorted_samples) - 1, round(q / 100 * len(sorted_samples)) - 1))
+    return round(sorted_samples[rank], 2)
+
+
+def summarize(endpoint, concurrency, latencies, errors, elapsed, first_events=None):
+    latencies = sorted(latencies)
+    summary = {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "mean_ms": round(sum(latencies) / len(latencies), 2) if latencies else None,
+        "rps": round((len(latencies) + errors) / elapsed, 2) if elapsed else None
+    }
+    if first_events:
+        # Time until the first streamed event, i.e. what a reader waits for
+        first_events = sorted(first_events)
+        summary["first_event_p50_ms"] = percentile(first_events, 50)
+        summary["first_event_p95_ms"] = percentile(first_events, 95)
+    return summary
+
+
+class Harness:
+    def __init__(self, app):
+        self.app = app
+        self.headers = None
+        self.run_id = datetime.utcnow().strftime("%Y%m%d%H%M%S")
+
+    def setup(self):
+        client = self.app.test_client()
+        credentials = {"username": "bench", "email": "bench@example.com", "password": "benchmark"}
+        client.post("/auth/register", json={**credentials, "role": "user"})
+        token = client.post("/auth/login", json=credentials).get_json()["access_token"]
+        self.headers = {"Authorization": f"Bearer {token}"}
+
+        # Seed one processed, embedded document for search and ask
+        response = self.upload(client, "seed", DOCUMENT)
+        document_id = response.get_json()["document_id"]
+
+        deadline = time.monotonic() + 120
+        while time.monotonic() < deadline:
+            status = client.get(f"/document/{document_id}/status", headers=self.headers).get_json()
+            if status.get("status") in ("processed", "failed"):
+                break
+            time.sleep(0.1)
+        if status.get("status") != "processed":
+            raise RuntimeError(f"Seed document was not processed: {status}")
+
+        from embeddings.ingest_chunks import ingest_chunks
+        ingest_chunks()
+
+    def upload(self, client, name, text):
+        return client.post(
+            "/document/upload",
+            headers=self.headers,
+            data={"file": (io.BytesIO(text.encode("utf-8")), f"{name}.txt")},
+            content_type="multipart/form-data"
+        )
+
+    def request(self, endpoint, client, i):
+        if endpoint in ("ask", "ask_stream"):
+            return client.post("/document/ask", headers=self.headers, buffered=False, json={
+                "query": f"How do I resolve ERR_{i % 400} in topic{i % 7}?",
+                "top_k": 3,
+                "stream": endpoint == "ask_stream"
+            })
+        if endpoint == "search":
+            return client.post("/document/search", headers=self.headers, json={
+                "query": f"ERR_{i % 400}", "top_k": 5
+            })
+        # Unique names and contents, so every upload is a new document
+        return self.upload(client, f"upload-{self.run_id}-{i}", f"Upload {self.run_id} {i}. {DOCUMENT}")
+
+    def measure(self, endpoint, concurrency, requests, offset=0):
+        latencies = []
+        first_events = []
+        errors = [0]
+        lock = threading.Lock()
+        start = threading.Barrier(concurrency + 1)
+
+        def worker(indices):
+            client = self.app.test_client()
+            start.wait()
+            for i in indices:
+                started = time.perf_counter()
+                first_event_ms = None
+                try:
+                    response = self.request(endpoint, client, i)
+                    # Read the whole body, so streamed answers are timed to the end
+                    for block in response.response:
+                        if first_event_ms is None and block:
+                            first_event_ms = (time.perf_counter() - started) * 1000
+                    response.close()
+                    ok = response.status_code < 400
+                except Exception as e:
+                    print(f"{endpoint} request failed:", e, file=sys.stderr)
+                    ok = False
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                with lock:
+                    if ok:
+                        latencies.append(elapsed_ms)
+                        if endpoint == "ask_stream" and first_event_ms is not None:
+                            first_events.append(first_event_ms)
+                    else:
+                        errors[0] += 1
+
+        threads = [
+            threading.Thread(target=worker, args=(range(offset + w, offset + requests, concurrency),))
+            for w in range(concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+
+        start.wait()
+        started = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        return summarize(endpoint, concurrency, latencies, errors[0], elapsed, first_events)
+
+
+def compare(results, baseline):
+    previous = {(r["endpoint"], r["concurrency"]): r for r in baseline["results"]}
+    comparison = []
+
+    for result in results:
+        before = previous.get((result["endpoint"], result["concurrency"]))
+        if not before or not before["p95_ms"] or not before["rps"]:
+            continue
+        comparison.append({
+            "endpoint": result["endpoint"],
+            "concurrency": result["concurrency"],
+            "p95_change": round(result["p95_ms"] / before["p95_ms"] - 1, 4),
+            "rps_change": round(result["rps"] / before["rps"] - 1, 4)
+        })
+
+    return {"baseline_commit": baseline.get("commit"), "results": comparison}
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def run(args):
+    with tempfile.TemporaryDirectory(prefix="request-latency-") as data_dir:
+        return run_in(args, data_dir)
+
+
+def run_in(args, data_dir):
+    configure_environment(args, data_dir)
+
+    from benchmarks.stand_ins import install
+    install(
+        mongo_ms=args.mongo_ms,
+        storage_ms=args.storage_ms,
+        vector_ms=args.vector_ms,
+        llm_ms=args.llm_ms,
+        llm_first_token_ms=args.llm_first_token_ms
+    )
+
+    from app import create_app
+    harness = Harness(create_app())
+    harness.setup()
+
+    results = []
+    offset = 0
+    for endpoint in args.endpoints:
+        harness.measure(endpoint, 1, args.warmup, offset)
+        offset += args.warmup
+        for concurrency in args.concurrency:
+            result = harness.measure(endpoint, concurrency, args.requests, offset)
+            offset += args.requests
+            print(
+                f"{endpoint:<7} concurrency={concurrency:<3} p50={result['p50_ms']}ms "
+                f"p95={result['p95_ms']}ms p99={result['p99_ms']}ms {result['rps']} req/sec",
+                file=sys.stderr
+            )
+            results.append(result)
+
+    # Let background work finish before the data directory goes away
+    from database.write_buffer import write_buffer
+    from documents.ingestion import ingestion_executor
+    from embeddings.pinecone_client import index
+    ingestion_executor.shutdown(wait=True)
+    write_buffer.flush()
+    index.save()
+
+    return {
+        "benchmark": "request_latency",
+        "commit": current_commit(),
+        "created_at": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "config": {
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "concurrency": args.concurrency,
+            "latency_ms": {
+                "mongo": args.mongo_ms,
+                "storage": args.storage_ms,
+                "embed": args.embed_ms,
+                "vector": args.vector_ms,
+                "llm": args.llm_ms,
+                "llm_first_token": args.llm_first_token_ms
+            },
+            "answer_cache": os.environ["ANSWER_CACHE_ENABLED"],
+            "embedding_cache": os.environ["EMBEDDING_CACHE_ENABLED"]
+        },
+        "results": results
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end latency and throughput of /ask (plain and streamed), /search and /upload")
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint and concurrency level")
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--mongo-ms", type=float, default=1)
+    parser.add_argument("--storage-ms", type=float, default=50)
+    parser.add_argument("--embed-ms", type=float, default=20)
+    parser.add_argument("--vector-ms", type=float, default=10)
+    parser.add_argument("--llm-ms", type=float, default=300)
+    parser.add_argument("--llm-first-token-ms", type=float, default=100, help="first streamed token delay, for ask_stream")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", help="earlier JSON report to compare p95 latency and req/sec against")
+    args = parser.parse_args()
+
+    # The app logs to stdout; keep it clear for the report
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run(args)
+        if args.baseline:
+            with open(args.baseline) as f:
+                report["comparison"] = compare(report["results"], json.load(f))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
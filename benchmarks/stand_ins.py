@@ -0,0 +1,119 @@
+import functools
+import os
+import time
+import types
+
+# Local stand-ins for Mongo, Cloudinary, the vector index and Groq, each with
+# an injected latency, so the request path can be benchmarked offline.
+# Mongo is replaced by mongomock (pip install mongomock). Call install()
+# after setting the environment and before importing the app.
+
+MONGO_METHODS = (
+    "find", "find_one", "insert_one", "insert_many", "update_one", "update_many",
+    "find_one_and_update", "bulk_write", "aggregate", "count_documents",
+    "estimated_document_count", "distinct", "delete_many"
+)
+
+FAKE_ANSWER = (
+    "According to the document context the requested details are described in "
+    "chunk 3 and chunk 4, which cover the error codes and the steps to resolve them."
+)
+
+
+def _delayed(fn, latency_ms):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        time.sleep(latency_ms / 1000)
+        return fn(*args, **kwargs)
+    return wrapper
+
+
+def _install_mongo(latency_ms):
+    import mongomock
+    import mongomock.collection
+
+    # pymongo passes sort= to bulk updates, which mongomock doesn't accept yet
+    add_update = mongomock.collection.BulkOperationBuilder.add_update
+
+    def add_update_without_sort(self, selector, doc, multi=False, upsert=False, collation=None,
+                                array_filters=None, hint=None, **kwargs):
+        return add_update(self, selector, doc, multi, upsert, collation=collation,
+                          array_filters=array_filters, hint=hint)
+
+    mongomock.collection.BulkOperationBuilder.add_update = add_update_without_sort
+
+    if latency_ms:
+        for name in MONGO_METHODS:
+            method = getattr(mongomock.collection.Collection, name)
+            setattr(mongomock.collection.Collection, name, _delayed(method, latency_ms))
+
+    patcher = mongomock.patch(servers=(("localhost", 27017),))
+    patcher.start()
+    return patcher
+
+
+def _install_storage(latency_ms):
+    import cloudinary.uploader
+
+    def upload(file, **kwargs):
+        time.sleep(latency_ms / 1000)
+        public_id = os.path.basename(str(file))
+        return {"secure_url": f"https://storage.invalid/{public_id}", "public_id": public_id}
+
+    cloudinary.uploader.upload = upload
+    cloudinary.uploader.destroy = _delayed(lambda public_id, **kwargs: {"result": "ok"}, latency_ms)
+
+
+def _install_vector_index(latency_ms):
+    from embeddings.local_index import LocalIndex
+
+    if latency_ms:
+        LocalIndex.query = _delayed(LocalIndex.query, latency_ms)
+        LocalIndex.upsert = _delayed(LocalIndex.upsert, latency_ms)
+
+
+def _install_llm(latency_ms, first_token_ms):
+    import llm.generator
+    from llm.tokens import count_tokens
+
+    def usage(prompt):
+        prompt_tokens = count_tokens(prompt)
+        completion_tokens = count_tokens(FAKE_ANSWER)
+        return types.SimpleNamespace(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens
+        )
+
+    def message(content):
+        return types.SimpleNamespace(
+            message=types.SimpleNamespace(content=content),
+            delta=types.SimpleNamespace(content=content)
+        )
+
+    def stream_chunks(prompt):
+        words = FAKE_ANSWER.split(" ")
+        time.sleep(first_token_ms / 1000)
+        for word in words:
+            time.sleep(max(latency_ms - first_token_ms, 0) / 1000 / len(words))
+            yield types.SimpleNamespace(choices=[message(word + " ")], usage=None, x_groq=None)
+        yield types.SimpleNamespace(choices=[], usage=usage(prompt), x_groq=None)
+
+    def create(model, messages, stream=False, **kwargs):
+        prompt = messages[0]["content"]
+        if stream:
+            return stream_chunks(prompt)
+        time.sleep(latency_ms / 1000)
+        return types.SimpleNamespace(choices=[message(FAKE_ANSWER)], usage=usage(prompt))
+
+    llm.generator.client = types.SimpleNamespace(
+        chat=types.SimpleNamespace(completions=types.SimpleNamespace(create=create))
+    )
+
+
+def install(mongo_ms=0, storage_ms=0, vector_ms=0, llm_ms=0, llm_first_token_ms=0):
+    patcher = _install_mongo(mongo_ms)
+    _install_storage(storage_ms)
+    _install_vector_index(vector_ms)
+    _install_llm(llm_ms, llm_first_token_ms)
+    return patcher
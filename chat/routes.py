@@ -1,19 +1,15 @@
 from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from pymongo import MongoClient
 from bson import ObjectId
-import os
-from dotenv import load_dotenv
-load_dotenv()
 from chat.chat_session_model import create_chat_session
+from database.mongo import chat_sessions_collection as chat_sessions, messages_collection
+from chat.utils import pending_session_messages
+from database.usage_counters import record_session
 
 
 
 chat_bp = Blueprint("chat", __name__)
 
-client = MongoClient(os.getenv("MONGO_URI"))
-db = client["KnowledgeAssistant"]
-chat_sessions = db["chat_sessions"]
 
 
 @chat_bp.route("/session", methods=["POST"])
@@ -30,6 +26,7 @@ def create_session():
     )
 
     result = chat_sessions.insert_one(session)
+    record_session(session)
 
     return jsonify({
         "success": True,
@@ -53,16 +50,21 @@ def get_chat_history(session_id):
             "msg": "Chat session not found"
         }), 404
 
-    messages_collection = db["messages"]
-
     msgs = list(
         messages_collection.find(
-            {"session_id": ObjectId(session_id)},
-            {"_id": 0}
+            {"session_id": ObjectId(session_id)}
         ).sort("created_at", 1)
     )
+    stored_ids = {m["_id"] for m in msgs}
+    pending = [
+        m for m in pending_session_messages(messages_collection, session_id)
+        if m["_id"] not in stored_ids
+    ]
+    if pending:
+        msgs = sorted(msgs + [dict(m) for m in pending], key=lambda m: m["created_at"])
 
     for msg in msgs:
+        del msg["_id"]
         msg["session_id"] = str(msg["session_id"])
         msg["user_id"] = str(msg["user_id"])
 
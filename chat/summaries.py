@@ -0,0 +1,169 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from bson import ObjectId
+from dotenv import load_dotenv
+from pymongo.errors import DuplicateKeyError
+
+from chat.utils import fit_history, format_chat_history, get_messages_after, get_recent_messages
+from database.mongo import conversation_summaries
+from llm.generator import summarize_conversation
+from llm.tokens import count_tokens
+
+load_dotenv()
+
+SUMMARY_ENABLED = os.getenv("SUMMARY_ENABLED", "true").lower() == "true"
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", 400))
+SUMMARY_CACHE_SIZE = int(os.getenv("SUMMARY_CACHE_SIZE", 10000))
+SUMMARY_FOLD_LIMIT = 20
+
+summary_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("SUMMARY_WORKERS", 2)),
+    thread_name_prefix="summary"
+)
+
+
+# Rolling summary per chat session. Once the messages not yet summarised
+# outgrow HISTORY_TOKEN_BUDGET, they are folded into the summary oldest
+# first, at most SUMMARY_FOLD_LIMIT per LLM call, until half the budget is
+# left. Prompts then carry the summary plus a few recent messages instead of
+# a growing transcript. Summaries live in Mongo and are cached in process;
+# an entry of None records a session with no summary.
+class ConversationSummaries:
+    def __init__(self, token_budget, max_entries):
+        self.token_budget = token_budget
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.updates = 0
+        self.failures = 0
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._updating = set()
+
+    def get(self, session_id):
+        session_id = ObjectId(session_id)
+
+        with self._lock:
+            if session_id in self._entries:
+                self._entries.move_to_end(session_id)
+                self.hits += 1
+                return self._entries[session_id]
+            self.misses += 1
+
+        summary = conversation_summaries.find_one({"_id": session_id})
+        self._cache(session_id, summary)
+        return summary
+
+    def _cache(self, session_id, summary):
+        with self._lock:
+            self._entries[session_id] = summary
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def history(self, messages_collection, session_id, limit, before=None):
+        summary = self.get(session_id)
+        recent = get_recent_messages(
+            messages_collection,
+            session_id,
+            limit,
+            before,
+            after=summary["covered_until"] if summary else None
+        )
+        # Until the next update catches up, the oldest raw messages give way
+        return summary, fit_history(recent, self.token_budget)
+
+    def schedule_update(self, messages_collection, session_id, on_usage=None):
+        session_id = ObjectId(session_id)
+        with self._lock:
+            if session_id in self._updating:
+                return
+            self._updating.add(session_id)
+
+        summary_executor.submit(self._update, messages_collection, session_id, on_usage)
+
+    def _update(self, messages_collection, session_id, on_usage):
+        try:
+            summary = self.get(session_id)
+            while summary is not False:
+                # One more than a fold, to know whether newer messages follow
+                pending = get_messages_after(
+                    messages_collection,
+                    session_id,
+                    after=summary["covered_until"] if summary else None,
+                    limit=SUMMARY_FOLD_LIMIT + 1
+                )
+
+                if len(pending) > SUMMARY_FOLD_LIMIT:
+                    folded = pending[:SUMMARY_FOLD_LIMIT]
+                else:
+                    if len(fit_history(pending, self.token_budget)) == len(pending):
+                        return
+                    kept = fit_history(pending, self.token_budget // 2)
+                    folded = pending[:len(pending) - len(kept)]
+
+                summary = self._fold(session_id, summary, folded, on_usage)
+        except Exception as e:
+            self.failures += 1
+            print("Conversation summary update failed:", e)
+        finally:
+            with self._lock:
+                self._updating.discard(session_id)
+
+    # Returns the new summary, or False when another writer got there first
+    def _fold(self, session_id, summary, folded, on_usage):
+        result = summarize_conversation(
+            summary["summary"] if summary else None,
+            format_chat_history(folded)
+        )
+        if on_usage:
+            on_usage(result["usage"])
+
+        updated = {
+            "summary": result["summary"],
+            "covered_until": folded[-1]["created_at"],
+            "messages_summarized": (summary["messages_summarized"] if summary else 0) + len(folded),
+            "token_count": count_tokens(result["summary"]),
+            "updated_at": datetime.utcnow()
+        }
+
+        # Another process may have summarised further already; the filter
+        # then misses and the upsert collides on _id.
+        try:
+            conversation_summaries.update_one(
+                {"_id": session_id, "covered_until": summary["covered_until"] if summary else None},
+                {"$set": updated},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            with self._lock:
+                self._entries.pop(session_id, None)
+            return False
+
+        updated = {"_id": session_id, **updated}
+        self._cache(session_id, updated)
+        self.updates += 1
+        return updated
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "updates": self.updates,
+                "failures": self.failures,
+                "entries": len(self._entries),
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+conversation_summary_store = (
+    ConversationSummaries(HISTORY_TOKEN_BUDGET, SUMMARY_CACHE_SIZE)
+    if SUMMARY_ENABLED else None
+)
@@ -1,19 +1,95 @@
 from bson import ObjectId
 
-def get_recent_messages(messages_collection, session_id, limit=6):
-    return list(
+from database.write_buffer import write_buffer
+from llm.tokens import count_tokens
+
+def pending_session_messages(messages_collection, session_id, before=None, after=None):
+    session_id = ObjectId(session_id)
+    return write_buffer.pending_documents(
+        messages_collection,
+        lambda m: (
+            m["session_id"] == session_id
+            and (before is None or m["created_at"] < before)
+            and (after is None or m["created_at"] > after)
+        )
+    )
+
+
+def get_recent_messages(messages_collection, session_id, limit=6, before=None, after=None):
+    query = {"session_id": ObjectId(session_id)}
+    if before is not None or after is not None:
+        query["created_at"] = {}
+        if before is not None:
+            query["created_at"]["$lt"] = before
+        if after is not None:
+            query["created_at"]["$gt"] = after
+
+    stored = list(
         messages_collection.find(
-            {"session_id": ObjectId(session_id)},
-            {"_id": 0, "role": 1, "content": 1}
+            query,
+            {"role": 1, "content": 1, "created_at": 1}
         )
         .sort("created_at", -1)
         .limit(limit)
-    )[::-1]
+    )
+
+    # Messages still in the write buffer are part of the conversation too
+    pending = pending_session_messages(messages_collection, session_id, before, after)
+    stored_ids = {m["_id"] for m in stored}
+    pending = [m for m in pending if m["_id"] not in stored_ids]
+    if pending:
+        stored.extend({"role": m["role"], "content": m["content"], "created_at": m["created_at"]} for m in pending)
+        stored.sort(key=lambda m: m["created_at"], reverse=True)
+        stored = stored[:limit]
+
+    return stored[::-1]
+
+
+def get_messages_after(messages_collection, session_id, after=None, limit=50):
+    # Oldest first, starting just after `after`
+    query = {"session_id": ObjectId(session_id)}
+    if after is not None:
+        query["created_at"] = {"$gt": after}
+
+    stored = list(
+        messages_collection.find(
+            query,
+            {"role": 1, "content": 1, "created_at": 1}
+        )
+        .sort("created_at", 1)
+        .limit(limit)
+    )
+
+    pending = pending_session_messages(messages_collection, session_id, after=after)
+    stored_ids = {m["_id"] for m in stored}
+    pending = [m for m in pending if m["_id"] not in stored_ids]
+    if pending:
+        stored.extend({"role": m["role"], "content": m["content"], "created_at": m["created_at"]} for m in pending)
+        stored.sort(key=lambda m: m["created_at"])
+        stored = stored[:limit]
+
+    return stored
+
+
+def format_message(msg):
+    role = "User" if msg["role"] == "user" else "Assistant"
+    return f"{role}: {msg['content']}"
+
+
+def fit_history(history, max_tokens):
+    # Drops the oldest messages until the rest fit, always keeping the last
+    kept = []
+    used = 0
+    for msg in reversed(history):
+        tokens = count_tokens(format_message(msg)) + 1
+        if kept and used + tokens > max_tokens:
+            break
+        kept.append(msg)
+        used += tokens
+    return kept[::-1]
 
 
-def format_chat_history(history):
-    lines = []
-    for msg in history:
-        role = "User" if msg["role"] == "user" else "Assistant"
-        lines.append(f"{role}: {msg['content']}")
-    return "\n".join(lines)
\ No newline at end of file
+def format_chat_history(history, summary=None):
+    lines = [f"Summary of earlier conversation: {summary}"] if summary else []
+    lines.extend(format_message(msg) for msg in history)
+    return "\n".join(lines)
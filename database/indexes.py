@@ -0,0 +1,204 @@
+import argparse
+import os
+import sys
+import threading
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure, PyMongoError
+
+from database.mongo import db
+
+ENSURE_INDEXES = os.getenv("MONGO_ENSURE_INDEXES", "true").lower() == "true"
+CHUNK_DELETIONS_TTL = int(os.getenv("CHUNK_DELETIONS_TTL", 86400))
+
+INDEXES = {
+    "users": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True)
+    ],
+    "documents": [
+        IndexModel(
+            [("uploaded_by", ASCENDING), ("is_active", ASCENDING)],
+            name="uploaded_by_active"
+        ),
+        IndexModel(
+            [("uploaded_by", ASCENDING), ("content_hash", ASCENDING)],
+            name="uploaded_by_content_hash"
+        ),
+        IndexModel(
+            [("uploaded_by", ASCENDING), ("original_filename", ASCENDING), ("uploaded_at", DESCENDING)],
+            name="uploaded_by_filename"
+        ),
+        IndexModel([("is_active", ASCENDING)], name="is_active")
+    ],
+    "document_chunks": [
+        IndexModel(
+            [("document_id", ASCENDING), ("chunk_index", ASCENDING)],
+            name="document_chunk_index"
+        ),
+        # Only chunks still waiting for an embedding are indexed for claiming
+        IndexModel(
+            [("embedded", ASCENDING), ("lease_expires_at", ASCENDING)],
+            name="unembedded_lease",
+            partialFilterExpression={"embedded": False}
+        ),
+        IndexModel(
+            [("lease_owner", ASCENDING)],
+            name="lease_owner",
+            partialFilterExpression={"embedded": False}
+        ),
+        IndexModel([("created_at", ASCENDING)], name="created_at")
+    ],
+    # Deletion log read by the lexical index sync; entries expire on their own
+    "chunk_deletions": [
+        IndexModel([("deleted_at", ASCENDING)], name="deleted_at_ttl", expireAfterSeconds=CHUNK_DELETIONS_TTL)
+    ],
+    "messages": [
+        IndexModel(
+            [("session_id", ASCENDING), ("created_at", ASCENDING)],
+            name="session_created_at"
+        ),
+        # Admin query listings page by (created_at, _id)
+        IndexModel(
+            [("role", ASCENDING), ("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+            name="role_user_created_at"
+        ),
+        IndexModel(
+            [("role", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+            name="role_created_at"
+        )
+    ],
+    "chat_sessions": [
+        IndexModel(
+            [("user_id", ASCENDING), ("updated_at", DESCENDING), ("_id", DESCENDING)],
+            name="user_updated_at"
+        ),
+        IndexModel([("updated_at", DESCENDING), ("_id", DESCENDING)], name="updated_at")
+    ],
+    "llm_usage_logs": [
+        IndexModel([("created_at", ASCENDING)], name="created_at"),
+        IndexModel(
+            [("user_id", ASCENDING), ("created_at", ASCENDING)],
+            name="user_created_at"
+        )
+    ],
+    "llm_usage_rollups": [
+        IndexModel(
+            [("granularity", ASCENDING), ("bucket", ASCENDING)],
+            name="granularity_bucket"
+        ),
+        IndexModel(
+            [("granularity", ASCENDING), ("user_id", ASCENDING), ("bucket", ASCENDING)],
+            name="granularity_user_bucket"
+        )
+    ],
+    "user_usage": [
+        IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True)
+    ]
+}
+
+
+def ensure_indexes():
+    # One reachability check, so an unreachable server costs one timeout
+    # rather than one per index
+    try:
+        db.client.admin.command("ping")
+    except PyMongoError as e:
+        print("Skipping index creation, MongoDB is unreachable:", e)
+        return False
+
+    # createIndexes is a no-op for indexes that already exist with the same spec
+    for collection_name, indexes in INDEXES.items():
+        for index in indexes:
+            try:
+                db[collection_name].create_indexes([index])
+            except PyMongoError as e:
+                print(f"Creating index {index.document['name']} on {collection_name} failed:", e)
+    return True
+
+
+def ensure_indexes_in_background():
+    thread = threading.Thread(target=ensure_indexes, name="ensure-indexes", daemon=True)
+    thread.start()
+    return thread
+
+
+# Representative shapes of the hot queries, checked with explain()
+_sample_id = ObjectId()
+
+HOT_QUERIES = [
+    ("messages", "recent history", {"session_id": _sample_id}, [("created_at", DESCENDING)]),
+    ("messages", "admin queries", {"role": "user"}, [("created_at", DESCENDING), ("_id", DESCENDING)]),
+    ("messages", "admin user queries", {"role": "user", "user_id": _sample_id}, [("created_at", DESCENDING), ("_id", DESCENDING)]),
+    ("chat_sessions", "user sessions", {"user_id": _sample_id}, [("updated_at", DESCENDING)]),
+    ("chat_sessions", "admin conversations", {}, [("updated_at", DESCENDING), ("_id", DESCENDING)]),
+    ("document_chunks", "claimable chunks", {
+        "embedded": False,
+        "$or": [{"lease_expires_at": None}, {"lease_expires_at": {"$lt": _sample_id.generation_time}}]
+    }, None),
+    ("document_chunks", "chunks of a document", {"document_id": _sample_id}, [("chunk_index", ASCENDING)]),
+    ("documents", "visible documents", {"is_active": True, "uploaded_by": str(_sample_id)}, None),
+    ("documents", "duplicate upload", {"uploaded_by": str(_sample_id), "content_hash": "0" * 64}, None),
+    ("user_usage", "user totals", {"user_id": _sample_id}, None),
+    ("llm_usage_rollups", "usage timeseries", {
+        "granularity": "day", "bucket": {"$gte": _sample_id.generation_time}
+    }, [("bucket", ASCENDING)]),
+    ("users", "login", {"email": "user@example.com"}, None)
+]
+
+
+def _plan_stages(plan):
+    yield plan
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from _plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from _plan_stages(child)
+
+
+def check_query_plans():
+    results = []
+
+    for collection_name, label, query, sort in HOT_QUERIES:
+        cursor = db[collection_name].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+
+        try:
+            winning_plan = cursor.explain()["queryPlanner"]["winningPlan"]
+        except (OperationFailure, KeyError) as e:
+            results.append({"collection": collection_name, "query": label, "error": str(e)})
+            continue
+
+        stages = list(_plan_stages(winning_plan))
+        index_names = sorted({s["indexName"] for s in stages if "indexName" in s})
+        results.append({
+            "collection": collection_name,
+            "query": label,
+            "indexes": index_names,
+            "collection_scan": any(s.get("stage") == "COLLSCAN" for s in stages),
+            "in_memory_sort": any(s.get("stage") == "SORT" for s in stages)
+        })
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create MongoDB indexes and check hot query plans")
+    parser.add_argument("--check", action="store_true", help="only explain() the hot queries")
+    args = parser.parse_args()
+
+    if not args.check and not ensure_indexes():
+        sys.exit(1)
+
+    failed = False
+    for result in check_query_plans():
+        ok = not result.get("error") and not result["collection_scan"] and not result["in_memory_sort"]
+        failed = failed or not ok
+        print("ok  " if ok else "FAIL", result)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+import os
+
+from pymongo import MongoClient
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "KnowledgeAssistant")
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", 100))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", 0))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", 300000))
+MONGO_TIMEOUT_MS = int(os.getenv("MONGO_TIMEOUT_MS", 5000))
+
+# One pooled client per process, shared by the blueprints, the ingestion
+# jobs, the embedding worker and the caches. PyMongo clients are thread
+# safe; worker processes import this module after forking or spawning.
+client = MongoClient(
+    os.getenv("MONGO_URI"),
+    appname="knowledge-assistant",
+    maxPoolSize=MONGO_MAX_POOL_SIZE,
+    minPoolSize=MONGO_MIN_POOL_SIZE,
+    maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+    serverSelectionTimeoutMS=MONGO_TIMEOUT_MS,
+    connectTimeoutMS=MONGO_TIMEOUT_MS,
+    retryWrites=True,
+    retryReads=True
+)
+db = client[MONGO_DB_NAME]
+
+users_collection = db["users"]
+documents_collection = db["documents"]
+chunks_collection = db["document_chunks"]
+chunk_deletions = db["chunk_deletions"]
+chat_sessions_collection = db["chat_sessions"]
+messages_collection = db["messages"]
+conversation_summaries = db["conversation_summaries"]
+llm_usage_logs = db["llm_usage_logs"]
+llm_usage_rollups = db["llm_usage_rollups"]
+user_usage = db["user_usage"]
+usage_counters = db["usage_counters"]
+scope_versions = db["scope_versions"]
+
+
+def get_collection(name):
+    return db[name]
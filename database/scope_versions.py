@@ -0,0 +1,36 @@
+from database.mongo import scope_versions
+
+_listeners = []
+
+
+def cache_scope(user_id, is_admin):
+    return "admin" if is_admin else f"user:{user_id}"
+
+
+# Every scope has a version counter in Mongo that is bumped whenever the set
+# of documents it can see changes. Process-local caches keyed by scope store
+# the version they were built at, so every web process drops stale entries.
+def scope_version(scope):
+    version = scope_versions.find_one({"_id": scope}, {"version": 1})
+    return version["version"] if version else 0
+
+
+def on_scope_change(callback):
+    _listeners.append(callback)
+
+
+def invalidate_scopes(scopes):
+    for scope in scopes:
+        scope_versions.update_one(
+            {"_id": scope},
+            {"$inc": {"version": 1}},
+            upsert=True
+        )
+
+    for callback in _listeners:
+        callback(scopes)
+
+
+def invalidate_document_scopes(owner_id):
+    # A document changing visibility or content affects its owner and admins.
+    invalidate_scopes(["admin", cache_scope(owner_id, False)])
@@ -0,0 +1,88 @@
+import os
+import threading
+import time
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from database.mongo import chat_sessions_collection, messages_collection, usage_counters
+from database.write_buffer import write_buffer
+
+USAGE_STATS_TTL = float(os.getenv("USAGE_STATS_TTL", 30))
+
+_MESSAGE_COUNTERS = {"user": "user_queries", "assistant": "ai_responses"}
+
+_stats_cache = {}
+_stats_lock = threading.Lock()
+
+
+# Running totals for the admin usage dashboard: one "global" document and
+# one "user:<id>" document, incremented through the write buffer as
+# sessions and messages are written.
+def _increment(user_id, field):
+    for key in ("global", f"user:{user_id}"):
+        write_buffer.write(usage_counters, UpdateOne({"_id": key}, {"$inc": {field: 1}}, upsert=True))
+
+
+def record_session(session):
+    _increment(session["user_id"], "chat_sessions")
+
+
+def record_message(message):
+    field = _MESSAGE_COUNTERS.get(message["role"])
+    if field:
+        _increment(message["user_id"], field)
+
+
+def read_counters(user_id=None):
+    key = f"user:{ObjectId(user_id)}" if user_id else "global"
+    return usage_counters.find_one({"_id": key}) or {}
+
+
+def cached_stats(key, compute):
+    now = time.monotonic()
+    with _stats_lock:
+        cached = _stats_cache.get(key)
+        if cached and cached[0] > now:
+            return cached[1]
+
+    stats = compute()
+    with _stats_lock:
+        _stats_cache[key] = (now + USAGE_STATS_TTL, stats)
+    return stats
+
+
+def backfill_counters():
+    # Recomputes every counter from the collections with $set, so it can be
+    # re-run; run it once when enabling the counters on existing data.
+    totals = {"global": {"chat_sessions": 0, "user_queries": 0, "ai_responses": 0}}
+
+    def add(user_id, field, count):
+        totals["global"][field] += count
+        user_totals = totals.setdefault(
+            f"user:{user_id}",
+            {"chat_sessions": 0, "user_queries": 0, "ai_responses": 0}
+        )
+        user_totals[field] += count
+
+    for row in chat_sessions_collection.aggregate([
+        {"$group": {"_id": "$user_id", "count": {"$sum": 1}}}
+    ]):
+        add(row["_id"], "chat_sessions", row["count"])
+
+    for row in messages_collection.aggregate([
+        {"$match": {"role": {"$in": list(_MESSAGE_COUNTERS)}}},
+        {"$group": {"_id": {"user_id": "$user_id", "role": "$role"}, "count": {"$sum": 1}}}
+    ]):
+        add(row["_id"]["user_id"], _MESSAGE_COUNTERS[row["_id"]["role"]], row["count"])
+
+    usage_counters.bulk_write([
+        UpdateOne({"_id": key}, {"$set": counters}, upsert=True)
+        for key, counters in totals.items()
+    ], ordered=False)
+
+    return len(totals)
+
+
+if __name__ == "__main__":
+    print("Usage counters written:", backfill_counters())
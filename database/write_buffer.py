@@ -0,0 +1,179 @@
+import atexit
+import os
+import threading
+import time
+from collections import deque
+
+from bson import ObjectId
+from pymongo import InsertOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+WRITE_BUFFER_ENABLED = os.getenv("WRITE_BUFFER_ENABLED", "true").lower() == "true"
+WRITE_BUFFER_MAX_OPS = int(os.getenv("WRITE_BUFFER_MAX_OPS", 500))
+WRITE_BUFFER_FLUSH_INTERVAL = float(os.getenv("WRITE_BUFFER_FLUSH_INTERVAL", 0.5))
+WRITE_BUFFER_MAX_RETRIES = 3
+
+
+# Write-behind queue for bookkeeping writes (messages, usage, session
+# timestamps). A background thread flushes it as one insert_many or ordered
+# bulk_write per collection once WRITE_BUFFER_MAX_OPS operations are queued
+# or WRITE_BUFFER_FLUSH_INTERVAL seconds have passed, and again at exit.
+class WriteBuffer:
+    def __init__(self, max_ops, flush_interval):
+        self.max_ops = max_ops
+        self.flush_interval = flush_interval
+
+        self.enqueued = 0
+        self.written = 0
+        self.batches = 0
+        self.failures = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.last_flush_ms = 0.0
+
+        self._queue = deque()
+        self._in_flight = []
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stopped = False
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="write-buffer", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def _enqueue(self, collection, operation, document=None):
+        with self._condition:
+            self._start()
+            self._queue.append((collection, operation, document, 0))
+            self.enqueued += 1
+            self.max_depth = max(self.max_depth, len(self._queue))
+            if len(self._queue) >= self.max_ops:
+                self._condition.notify()
+
+    def insert(self, collection, document):
+        # Ids are assigned up front so readers can de-duplicate against Mongo
+        document.setdefault("_id", ObjectId())
+        self._enqueue(collection, InsertOne(document), document)
+
+    def write(self, collection, operation):
+        self._enqueue(collection, operation)
+
+    def pending_documents(self, collection, predicate):
+        # Inserts not flushed yet, for reads that must see their own writes
+        with self._condition:
+            return [
+                document
+                for queued_collection, _, document, _ in [*self._in_flight, *self._queue]
+                if document is not None and queued_collection.name == collection.name and predicate(document)
+            ]
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._stopped and len(self._queue) < self.max_ops:
+                    self._condition.wait(self.flush_interval)
+                if self._stopped and not self._queue:
+                    return
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._condition:
+                batch = list(self._queue)
+                self._queue.clear()
+                self._in_flight = batch
+            if not batch:
+                return
+
+            started = time.perf_counter()
+            by_collection = {}
+            for item in batch:
+                by_collection.setdefault(item[0].name, []).append(item)
+
+            for items in by_collection.values():
+                self._write_batch(items)
+
+            with self._condition:
+                self._in_flight = []
+
+            self.batches += 1
+            self.last_flush_ms = round((time.perf_counter() - started) * 1000, 2)
+
+    def _write_batch(self, items):
+        collection = items[0][0]
+        try:
+            if all(document is not None for _, _, document, _ in items):
+                collection.insert_many([document for _, _, document, _ in items], ordered=False)
+            else:
+                collection.bulk_write([operation for _, operation, _, _ in items], ordered=True)
+            self.written += len(items)
+        except BulkWriteError as e:
+            # Rejected operations (e.g. duplicate keys) would fail again
+            self.failures += 1
+            self.dropped += len(e.details.get("writeErrors", []))
+            self.written += e.details.get("nInserted", 0) + e.details.get("nModified", 0) + e.details.get("nUpserted", 0)
+            print(f"Buffered writes to {collection.name} partly failed:", e.details.get("writeErrors", [])[:3])
+        except PyMongoError as e:
+            # Only inserts are retried: they are idempotent by _id, while a
+            # replayed $inc could double count. The driver already retries
+            # transient errors once (retryWrites).
+            self.failures += 1
+            print(f"Buffered writes to {collection.name} failed:", e)
+            retry = [
+                (c, operation, document, attempts + 1)
+                for c, operation, document, attempts in items
+                if document is not None and attempts + 1 < WRITE_BUFFER_MAX_RETRIES
+            ]
+            self.dropped += len(items) - len(retry)
+            with self._condition:
+                self._queue.extendleft(reversed(retry))
+
+    def close(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+        self.flush()
+
+    def stats(self):
+        with self._condition:
+            depth = len(self._queue)
+        return {
+            "queue_depth": depth,
+            "max_queue_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "batches": self.batches,
+            "failures": self.failures,
+            "dropped": self.dropped,
+            "last_flush_ms": self.last_flush_ms
+        }
+
+
+# With the buffer disabled the same calls write straight through
+class DirectWriter:
+    def insert(self, collection, document):
+        document.setdefault("_id", ObjectId())
+        collection.insert_one(document)
+
+    def write(self, collection, operation):
+        collection.bulk_write([operation])
+
+    def pending_documents(self, collection, predicate):
+        return []
+
+    def flush(self):
+        pass
+
+    def stats(self):
+        return None
+
+
+write_buffer = (
+    WriteBuffer(WRITE_BUFFER_MAX_OPS, WRITE_BUFFER_FLUSH_INTERVAL)
+    if WRITE_BUFFER_ENABLED else DirectWriter()
+)
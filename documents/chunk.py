@@ -1,20 +1,113 @@
-def chunk_text(text,chunk_size=200,overlap=30):
+import os
+import re
+
+from llm.tokens import count_tokens
+
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", 256))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", 40))
+
+# A sentence runs to terminal punctuation, a paragraph break or the end of the page
+_SENTENCE_PATTERN = re.compile(r"\S.*?(?:[.!?]+(?=\s|$)|(?=\n\s*\n)|$)", re.S)
+_WORD_PATTERN = re.compile(r"\S+")
+
+
+def _split_long_sentence(text, start, max_tokens):
+    # Sentences over the limit are cut at word boundaries instead
+    piece_start = None
+    piece_end = None
+    piece_tokens = 0
+
+    for word in _WORD_PATTERN.finditer(text):
+        word_tokens = count_tokens(word.group())
+        if piece_start is not None and piece_tokens + word_tokens > max_tokens:
+            yield start + piece_start, start + piece_end, piece_tokens
+            piece_start = None
+            piece_tokens = 0
+
+        if piece_start is None:
+            piece_start = word.start()
+        piece_end = word.end()
+        piece_tokens += word_tokens
+
+    if piece_start is not None:
+        yield start + piece_start, start + piece_end, piece_tokens
+
+
+def _iter_sentences(pages, max_tokens):
+    # Offsets are into "\n".join(pages). Each sentence carries the raw text
+    # separating it from the previous one, so chunks can be rebuilt exactly.
+    page_offset = 0
+    pending_gap = ""
+
+    for page_number, page_text in enumerate(pages, start=1):
+        previous_end = 0
+
+        for match in _SENTENCE_PATTERN.finditer(page_text):
+            sentence = match.group().rstrip()
+            sentence_start = match.start()
+            tokens = count_tokens(sentence)
+
+            if tokens > max_tokens:
+                pieces = _split_long_sentence(sentence, sentence_start, max_tokens)
+            else:
+                pieces = [(sentence_start, sentence_start + len(sentence), tokens)]
+
+            for start, end, piece_tokens in pieces:
+                yield {
+                    "gap": pending_gap + page_text[previous_end:start],
+                    "text": page_text[start:end],
+                    "tokens": piece_tokens,
+                    "page": page_number,
+                    "char_start": page_offset + start,
+                    "char_end": page_offset + end
+                }
+                pending_gap = ""
+                previous_end = end
+
+        pending_gap += page_text[previous_end:] + "\n"
+        page_offset += len(page_text) + 1
+
+
+def _make_chunk(sentences):
+    return {
+        "text": sentences[0]["text"] + "".join(s["gap"] + s["text"] for s in sentences[1:]),
+        "page": sentences[0]["page"],
+        "char_start": sentences[0]["char_start"],
+        "char_end": sentences[-1]["char_end"]
+    }
+
+
+def iter_chunks(pages, max_tokens=CHUNK_MAX_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    current = []
+    current_tokens = 0
+
+    for sentence in _iter_sentences(pages, max_tokens):
+        if current and current_tokens + sentence["tokens"] > max_tokens:
+            yield _make_chunk(current)
+
+            # Carry trailing sentences into the next chunk as overlap
+            kept = []
+            kept_tokens = 0
+            for previous in reversed(current):
+                if kept_tokens + previous["tokens"] > overlap_tokens:
+                    break
+                kept.insert(0, previous)
+                kept_tokens += previous["tokens"]
+
+            while kept and kept_tokens + sentence["tokens"] > max_tokens:
+                kept_tokens -= kept.pop(0)["tokens"]
+
+            current = kept
+            current_tokens = kept_tokens
+
+        current.append(sentence)
+        current_tokens += sentence["tokens"]
+
+    if current:
+        yield _make_chunk(current)
+
+
+def chunk_text(text, max_tokens=CHUNK_MAX_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
     if not text:
         return []
-    words=text.split()
-    chunks=[]
-    
-    start=0
-    total_words=len(words)
-
-    while start< total_words:
-        end=start+chunk_size
-        chunk_words=words[start:end]
-        chunks.append(" ".join(chunk_words))
-
-        start=end-overlap
-
-        if start< 0:
-            start = 0
-    
-    return chunks
\ No newline at end of file
+    return [chunk["text"] for chunk in iter_chunks([text], max_tokens, overlap_tokens)]
@@ -1,12 +1,23 @@
+import hashlib
 from datetime import datetime
+from llm.tokens import count_tokens
 
 
 
-def document_chunk(document_id, chunk_index, text):
+def chunk_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def document_chunk(document_id, chunk_index, text, page=None, char_start=None, char_end=None):
     return{
         "document_id": document_id,
         "chunk_index": chunk_index,
         "text": text,
+        "content_hash": chunk_hash(text),
+        "token_count": count_tokens(text),
+        "page": page,
+        "char_start": char_start,
+        "char_end": char_end,
         "embedded": False,
         "created_at": datetime.utcnow()
     }
\ No newline at end of file
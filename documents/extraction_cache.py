@@ -0,0 +1,45 @@
+import gzip
+import json
+import os
+import tempfile
+
+from dotenv import load_dotenv
+load_dotenv()
+
+EXTRACTION_CACHE_ENABLED = os.getenv("EXTRACTION_CACHE_ENABLED", "true").lower() == "true"
+EXTRACTION_CACHE_DIR = os.getenv("EXTRACTION_CACHE_DIR", ".cache/extractions")
+
+
+# Extracted page text keyed by the sha256 of the uploaded file, stored as
+# one gzipped JSON list per file so retries and re-uploads skip parsing.
+def _cache_path(content_hash):
+    return os.path.join(EXTRACTION_CACHE_DIR, content_hash[:2], f"{content_hash}.json.gz")
+
+
+def load_pages(content_hash):
+    if not EXTRACTION_CACHE_ENABLED or not content_hash:
+        return None
+
+    try:
+        with gzip.open(_cache_path(content_hash), "rt", encoding="utf-8") as cached:
+            return json.load(cached)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print("Extraction cache read failed:", e)
+        return None
+
+
+def store_pages(content_hash, pages):
+    if not EXTRACTION_CACHE_ENABLED or not content_hash:
+        return
+
+    path = _cache_path(content_hash)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as raw, gzip.open(raw, "wt", encoding="utf-8") as cached:
+            json.dump(pages, cached)
+        os.replace(temp_path, path)
+    except OSError as e:
+        print("Extraction cache write failed:", e)
@@ -0,0 +1,400 @@
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import cloudinary
+import cloudinary.uploader
+from pymongo import UpdateOne
+from dotenv import load_dotenv
+
+from database.mongo import documents_collection, chunks_collection
+from documents.chunk import iter_chunks
+from documents.chunk_model import document_chunk
+from documents.extraction_cache import load_pages, store_pages
+from documents.text_extractor import extract_pages
+from embeddings.ingest_chunks import delete_chunk_vectors, update_chunk_indexes
+from embeddings.worker import notify_new_chunks
+from embeddings.lexical_index import lexical_index
+from database.scope_versions import invalidate_document_scopes
+from monitoring.metrics import INGESTION_JOBS, span
+
+load_dotenv()
+
+
+CHUNK_INSERT_BATCH_SIZE = int(os.getenv("CHUNK_INSERT_BATCH_SIZE", 500))
+PROGRESS_PAGE_INTERVAL = 10
+INGESTION_HEARTBEAT_SECONDS = int(os.getenv("INGESTION_HEARTBEAT_SECONDS", 30))
+INGESTION_STALE_SECONDS = int(os.getenv("INGESTION_STALE_SECONDS", 300))
+
+ingestion_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("INGESTION_WORKERS", 2)),
+    thread_name_prefix="ingest"
+)
+upload_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("UPLOAD_WORKERS", 4)),
+    thread_name_prefix="upload"
+)
+
+
+def _update_document(document_id, update):
+    documents_collection.update_one({"_id": document_id}, update)
+
+
+def _write_chunks(document_id, chunks):
+    chunks_collection.insert_many(chunks, ordered=True)
+    lexical_index.add_chunks(chunks)
+    _update_document(document_id, {"$inc": {"progress.chunks_written": len(chunks)}})
+    notify_new_chunks()
+
+
+def _remove_chunks(chunk_ids):
+    if not chunk_ids:
+        return
+    lexical_index.remove_chunks(chunk_ids)
+    chunks_collection.delete_many({"_id": {"$in": chunk_ids}})
+    lexical_index.log_deletions(chunk_ids)
+    try:
+        delete_chunk_vectors(chunk_ids)
+    except Exception as e:
+        print("Vector delete failed:", e)
+
+
+def _tracked_pages(document_id, pages):
+    extracted = 0
+
+    for page_text in pages:
+        extracted += 1
+        if extracted % PROGRESS_PAGE_INTERVAL == 0:
+            _update_document(document_id, {"$set": {"progress.pages_extracted": extracted}})
+        yield page_text
+
+    _update_document(document_id, {"$set": {"progress.pages_extracted": extracted}})
+
+
+def _cached_pages(temp_path, file_type, content_hash):
+    cached = load_pages(content_hash)
+    if cached is not None:
+        yield from cached
+        return
+
+    pages = []
+    failures = []
+    for page_text in extract_pages(temp_path, file_type, failures):
+        pages.append(page_text)
+        yield page_text
+
+    # Skipped pages would otherwise stay missing for every later upload
+    if failures:
+        print(f"Not caching extraction with {len(failures)} skipped pages")
+    else:
+        store_pages(content_hash, pages)
+
+
+def _existing_chunks(document_id):
+    # Unchanged chunks of a revised document are matched by content hash
+    existing = defaultdict(deque)
+    for chunk in chunks_collection.find(
+        {"document_id": document_id},
+        {"content_hash": 1, "chunk_index": 1, "embedded": 1}
+    ).sort("chunk_index", 1):
+        existing[chunk.get("content_hash")].append(chunk)
+    return existing
+
+
+def _extract_and_chunk(document_id, temp_path, file_type, content_hash=None, existing=None):
+    pages = _tracked_pages(document_id, _cached_pages(temp_path, file_type, content_hash))
+
+    batch = []
+    kept = []
+    moved = []
+    inserted_ids = []
+    chunk_count = 0
+
+    for index, chunk in enumerate(iter_chunks(pages)):
+        record = document_chunk(
+            document_id=document_id,
+            chunk_index=index,
+            text=chunk["text"],
+            page=chunk["page"],
+            char_start=chunk["char_start"],
+            char_end=chunk["char_end"]
+        )
+        chunk_count += 1
+
+        matches = existing.get(record["content_hash"]) if existing else None
+        if matches:
+            # Reordering is applied once the new version is complete
+            match = matches.popleft()
+            if match.get("embedded") and match.get("chunk_index") != index:
+                moved.append((match["_id"], index))
+            kept.append(UpdateOne({"_id": match["_id"]}, {"$set": {
+                "chunk_index": index,
+                "page": record["page"],
+                "char_start": record["char_start"],
+                "char_end": record["char_end"]
+            }}))
+            continue
+
+        batch.append(record)
+        if len(batch) >= CHUNK_INSERT_BATCH_SIZE:
+            _write_chunks(document_id, batch)
+            inserted_ids.extend(c["_id"] for c in batch)
+            batch = []
+
+    if batch:
+        _write_chunks(document_id, batch)
+        inserted_ids.extend(c["_id"] for c in batch)
+
+    return chunk_count, kept, moved, inserted_ids
+
+
+def _destroy_asset(public_id):
+    try:
+        cloudinary.uploader.destroy(public_id, resource_type="raw")
+    except Exception as e:
+        print("Cloudinary cleanup failed:", e)
+
+
+def run_ingestion_job(document_id, temp_path, file_type, owner_id, content_hash=None, previous=None):
+    upload_future = upload_executor.submit(
+        cloudinary.uploader.upload,
+        temp_path,
+        resource_type="raw",
+        folder="knowledge_assistant"
+    )
+
+    existing = None
+    previous_ids = set()
+    stored = False
+
+    try:
+        _update_document(document_id, {"$set": {"status": "processing"}})
+
+        # A revision keeps serving its previous chunks until the new ones are in
+        if previous:
+            existing = _existing_chunks(document_id)
+            previous_ids = {c["_id"] for matches in existing.values() for c in matches}
+
+        with span("ingestion.extract_and_chunk"):
+            chunk_count, kept, moved, inserted_ids = _extract_and_chunk(
+                document_id, temp_path, file_type, content_hash, existing
+            )
+        with span("ingestion.storage_upload_wait"):
+            upload_result = upload_future.result()
+
+        if kept:
+            chunks_collection.bulk_write(kept, ordered=False)
+        if moved:
+            # Kept chunks aren't re-embedded, so their vectors are re-indexed in place
+            try:
+                update_chunk_indexes(moved)
+            except Exception as e:
+                print("Vector chunk_index update failed:", e)
+
+        update = {
+            "filename": upload_result["public_id"],
+            "cloudinary_url": upload_result["secure_url"],
+            "cloudinary_public_id": upload_result["public_id"],
+            "content_hash": content_hash,
+            "chunk_count": chunk_count,
+            "status": "processed",
+            "error": None
+        }
+
+        if previous:
+            removed = [chunk for matches in existing.values() for chunk in matches]
+            _remove_chunks([chunk["_id"] for chunk in removed])
+
+            update["revised_at"] = datetime.utcnow()
+            update["revision"] = {
+                "chunks_kept": len(kept),
+                "chunks_added": len(inserted_ids),
+                "chunks_removed": len(removed)
+            }
+            _update_document(document_id, {
+                "$set": update,
+                "$inc": {
+                    "progress.chunks_written": len(kept),
+                    "progress.chunks_embedded": len(kept)
+                }
+            })
+
+            if previous.get("cloudinary_public_id") and previous["cloudinary_public_id"] != upload_result["public_id"]:
+                upload_executor.submit(_destroy_asset, previous["cloudinary_public_id"])
+        else:
+            _update_document(document_id, {"$set": update})
+        stored = True
+
+        invalidate_document_scopes(owner_id)
+    except Exception as e:
+        print("Ingestion job failed:", e)
+        # The copy uploaded for this job is referenced by nothing
+        if not stored and upload_future.exception() is None:
+            public_id = upload_future.result()["public_id"]
+            if not previous or public_id != previous.get("cloudinary_public_id"):
+                upload_executor.submit(_destroy_asset, public_id)
+        if previous:
+            # The previous version stays in place, only the new chunks go
+            _remove_chunks([
+                chunk_id
+                for chunk_id in chunks_collection.distinct("_id", {"document_id": document_id})
+                if chunk_id not in previous_ids
+            ])
+            _update_document(document_id, {"$set": {"status": "processed", "error": str(e)}})
+        else:
+            _remove_chunks(chunks_collection.distinct("_id", {"document_id": document_id}))
+            _update_document(document_id, {"$set": {"status": "failed", "error": str(e)}})
+    finally:
+        upload_future.exception()
+        os.remove(temp_path)
+        try:
+            _update_document(document_id, {"$unset": {"job": ""}})
+        except Exception as e:
+            print("Clearing ingestion job failed:", e)
+
+
+# Jobs only live in this process's executor. Each document in flight records
+# the process that owns it and where its upload is spooled; the owner keeps
+# a heartbeat on them so a restarted process can tell which jobs were lost.
+_boot_id = uuid.uuid4().hex
+_heartbeat_lock = threading.Lock()
+_heartbeat_pid = None
+
+
+def _job_owner():
+    return f"{socket.gethostname()}:{os.getpid()}:{_boot_id}"
+
+
+def new_job(temp_path, content_hash):
+    now = datetime.utcnow()
+    return {
+        "owner": _job_owner(),
+        "spool_path": temp_path,
+        "content_hash": content_hash,
+        "submitted_at": now,
+        "heartbeat_at": now
+    }
+
+
+def _heartbeat():
+    while True:
+        try:
+            documents_collection.update_many(
+                {"job.owner": _job_owner()},
+                {"$set": {"job.heartbeat_at": datetime.utcnow()}}
+            )
+        except Exception as e:
+            print("Ingestion heartbeat failed:", e)
+        time.sleep(INGESTION_HEARTBEAT_SECONDS)
+
+
+def _start_heartbeat():
+    global _heartbeat_pid
+    with _heartbeat_lock:
+        # Threads don't survive a fork, so each worker process starts its own
+        if _heartbeat_pid == os.getpid():
+            return
+        _heartbeat_pid = os.getpid()
+    threading.Thread(target=_heartbeat, name="ingestion-heartbeat", daemon=True).start()
+
+
+def submit_ingestion_job(document_id, temp_path, file_type, owner_id, content_hash=None, previous=None):
+    _start_heartbeat()
+    INGESTION_JOBS.inc()
+    future = ingestion_executor.submit(
+        run_ingestion_job, document_id, temp_path, file_type, owner_id, content_hash, previous
+    )
+    future.add_done_callback(lambda _: INGESTION_JOBS.dec())
+    return future
+
+
+def _recover_job(document, stale_before):
+    job = document.get("job") or {}
+    claimed = documents_collection.find_one_and_update(
+        {
+            "_id": document["_id"],
+            "status": {"$in": ["uploaded", "processing"]},
+            "job.owner": job.get("owner"),
+            "job.heartbeat_at": job.get("heartbeat_at")
+        },
+        {"$set": {"job": new_job(job.get("spool_path"), job.get("content_hash"))}}
+    )
+    if not claimed:
+        # Another process recovered it first
+        return
+
+    document_id = document["_id"]
+    revision = bool(document.get("cloudinary_public_id"))
+
+    # Chunks written by the lost run; a revision keeps its previous ones
+    if revision:
+        partial = {"document_id": document_id, "created_at": {"$gte": job.get("submitted_at") or stale_before}}
+    else:
+        partial = {"document_id": document_id}
+    _remove_chunks(chunks_collection.distinct("_id", partial))
+
+    spool_path = job.get("spool_path")
+    if spool_path and os.path.exists(spool_path):
+        _update_document(document_id, {"$set": {
+            "status": "uploaded",
+            "progress": {"pages_extracted": 0, "chunks_written": 0, "chunks_embedded": 0}
+        }})
+        previous = {"_id": document_id, "cloudinary_public_id": document["cloudinary_public_id"]} if revision else None
+        submit_ingestion_job(
+            document_id, spool_path, document["file_type"], document["uploaded_by"],
+            job.get("content_hash") or document.get("content_hash"), previous
+        )
+        print("Requeued interrupted ingestion job:", document_id)
+        return
+
+    # The upload was spooled on another machine or is gone
+    error = "Ingestion was interrupted by a restart; upload the file again"
+    if revision:
+        _update_document(document_id, {"$set": {"status": "processed", "error": error}, "$unset": {"job": ""}})
+    else:
+        _update_document(document_id, {"$set": {"status": "failed", "error": error}, "$unset": {"job": ""}})
+    invalidate_document_scopes(document["uploaded_by"])
+    print("Marked interrupted ingestion job failed:", document_id)
+
+
+def recover_interrupted_jobs():
+    stale_before = datetime.utcnow() - timedelta(seconds=INGESTION_STALE_SECONDS)
+    try:
+        stale = list(documents_collection.find(
+            {
+                "status": {"$in": ["uploaded", "processing"]},
+                "$or": [
+                    {"job.heartbeat_at": {"$lt": stale_before}},
+                    # Documents from before jobs were recorded
+                    {"job": {"$exists": False}, "uploaded_at": {"$lt": stale_before}}
+                ]
+            },
+            {"file_type": 1, "uploaded_by": 1, "content_hash": 1, "cloudinary_public_id": 1, "job": 1}
+        ))
+    except Exception as e:
+        print("Looking up interrupted ingestion jobs failed:", e)
+        return
+
+    for document in stale:
+        try:
+            _recover_job(document, stale_before)
+        except Exception as e:
+            print("Recovering ingestion job failed:", document["_id"], e)
+
+
+def recover_interrupted_jobs_in_background():
+    # Jobs of a process that died just before this one started only go
+    # stale later, so look once more after that
+    def run():
+        recover_interrupted_jobs()
+        time.sleep(INGESTION_STALE_SECONDS)
+        recover_interrupted_jobs()
+
+    thread = threading.Thread(target=run, name="ingestion-recovery", daemon=True)
+    thread.start()
+    return thread
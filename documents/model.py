@@ -6,7 +6,8 @@ def create_document(
     file_type,
     uploaded_by,
     cloudinary_url=None,
-    cloudinary_public_id=None
+    cloudinary_public_id=None,
+    content_hash=None
 ):
     return {
         "filename": filename,
@@ -16,7 +17,13 @@ def create_document(
         "uploaded_at": datetime.utcnow(),
         "cloudinary_url": cloudinary_url,
         "cloudinary_public_id": cloudinary_public_id,
+        "content_hash": content_hash,
         "status": "uploaded",
         "is_active": True,
-        "chunk_count": 0
+        "chunk_count": 0,
+        "progress": {
+            "pages_extracted": 0,
+            "chunks_written": 0,
+            "chunks_embedded": 0
+        }
     }
@@ -1,41 +1,46 @@
 import os
-import requests
+import json
+import hashlib
 import tempfile
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
-from pymongo import MongoClient
 from bson import ObjectId
+from pymongo import UpdateOne
 from datetime import datetime
-
-import cloudinary
-import cloudinary.uploader
-
+from concurrent.futures import ThreadPoolExecutor
+
+from database.mongo import (
+    documents_collection,
+    chat_sessions_collection as chat_sessions,
+    messages_collection as messages,
+    llm_usage_logs,
+    user_usage
+)
+from database.usage_counters import record_message, record_session
+from database.write_buffer import write_buffer, WRITE_BUFFER_ENABLED
 from documents.model import create_document
-from documents.chunk_model import document_chunk
-from documents.chunk import chunk_text
-from documents.text_extractor import extract_text
-from embeddings.retriever import retrieve_chunks
-from llm.generator import generate_answer
+from documents.stage_timings import StageTimings
+from documents.ingestion import new_job, submit_ingestion_job
+from embeddings.retriever import retrieve_chunks, visible_document_ids, RETRIEVAL_MODE
+from embeddings.embedder import embed_text
+from database.scope_versions import cache_scope, invalidate_document_scopes
+from llm.answer_cache import answer_cache
+from llm.generator import generate_answer, stream_answer, get_sources
 from chat.chat_session_model import create_chat_session
 from chat.message_model import create_message
 from chat.utils import get_recent_messages, format_chat_history
+from chat.summaries import conversation_summary_store
 from documents.usage_log_model import create_llm_usage_log
+from documents.usage_rollups import record_usage_rollups
 import re
 
 
 document_bp = Blueprint("documents", __name__)
 
 ALLOWED_EXTENSIONS = {"txt", "pdf"}
+UPLOAD_READ_SIZE = 1024 * 1024
 
 
-client = MongoClient(os.getenv("MONGO_URI"))
-db = client["KnowledgeAssistant"]
-documents_collection = db["documents"]
-chunks_collection = db["document_chunks"]
-chat_sessions = db["chat_sessions"]
-messages = db["messages"]
-llm_usage_logs = db["llm_usage_logs"]
-user_usage = db["user_usage"]
 
 
 SMALL_TALK_PATTERNS = [
@@ -55,6 +60,27 @@ def is_small_talk(query: str) -> bool:
     return any(re.match(p, q) for p in SMALL_TALK_PATTERNS)
 
 
+INPUT_TOKEN_PRICE = 0.0001 / 1000
+OUTPUT_TOKEN_PRICE = 0.0002 / 1000
+
+HISTORY_LIMIT = 6
+ASK_CONCURRENT = os.getenv("ASK_CONCURRENT", "true").lower() == "true"
+
+# Independent stages of /ask run on ask_executor. Persistence after the
+# answer only enqueues into the write buffer; without the buffer it runs
+# on write_executor so it stays off the response path.
+ask_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("ASK_WORKERS", 16)),
+    thread_name_prefix="ask"
+) if ASK_CONCURRENT else None
+write_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("ASK_WRITE_WORKERS", 4)),
+    thread_name_prefix="ask-write"
+) if ASK_CONCURRENT and not WRITE_BUFFER_ENABLED else None
+
+SMALL_TALK_ANSWER = "Hi there. Ask me something based on your uploaded documents and I’ll help."
+
+
 def allowed_file(filename):
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
@@ -78,67 +104,123 @@ def upload_doc():
     file_type = original_filename.rsplit(".", 1)[1].lower()
 
 
-    upload_result = cloudinary.uploader.upload(
-        file,
-        resource_type="raw",
-        folder="knowledge_assistant"
+    # Spool the upload to disk once; storage and extraction both read that copy.
+    content_hash = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(delete=False, suffix=f".{file_type}") as tmp:
+        temp_path = tmp.name
+        try:
+            for block in iter(lambda: file.stream.read(UPLOAD_READ_SIZE), b""):
+                content_hash.update(block)
+                tmp.write(block)
+        except Exception:
+            tmp.close()
+            os.remove(temp_path)
+            raise
+    content_hash = content_hash.hexdigest()
+
+    try:
+        return _accept_upload(user_id, original_filename, file_type, temp_path, content_hash)
+    except Exception:
+        # Until a job owns it, the spooled copy is ours to remove
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def _accept_upload(user_id, original_filename, file_type, temp_path, content_hash):
+    duplicate = documents_collection.find_one(
+        {
+            "uploaded_by": user_id,
+            "content_hash": content_hash,
+            "status": {"$ne": "failed"},
+            "is_active": True
+        },
+        {"status": 1}
     )
+    if duplicate:
+        os.remove(temp_path)
+        return jsonify({
+            "success": True,
+            "msg": "Document already uploaded",
+            "document_id": str(duplicate["_id"]),
+            "status": duplicate["status"],
+            "duplicate": True,
+            "status_url": f"/document/{duplicate['_id']}/status"
+        }), 200
 
-    cloudinary_url = upload_result["secure_url"]
-    public_id = upload_result["public_id"]
-
-    response = requests.get(cloudinary_url)
-    if response.status_code != 200:
-        return jsonify({"success": False, "msg": "Failed to download file"}), 500
+    # Re-uploading a processed file under the same name revises it in place
+    previous = documents_collection.find_one_and_update(
+        {
+            "uploaded_by": user_id,
+            "original_filename": original_filename,
+            "file_type": file_type,
+            "status": "processed",
+            "is_active": True
+        },
+        {"$set": {
+            "status": "uploaded",
+            "progress": {"pages_extracted": 0, "chunks_written": 0, "chunks_embedded": 0},
+            "job": new_job(temp_path, content_hash)
+        }},
+        projection={"cloudinary_public_id": 1},
+        sort=[("uploaded_at", -1)]
+    )
 
-    with tempfile.NamedTemporaryFile(delete=False) as tmp:
-        tmp.write(response.content)
-        temp_path = tmp.name
+    if previous:
+        document_id = previous["_id"]
+    else:
+        document = create_document(
+            filename=original_filename,
+            original_filename=original_filename,
+            file_type=file_type,
+            uploaded_by=user_id,
+            content_hash=content_hash
+        )
+        document["job"] = new_job(temp_path, content_hash)
 
-    extracted_text = extract_text(temp_path, file_type)
+        doc_result = documents_collection.insert_one(document)
+        document_id = doc_result.inserted_id
+        invalidate_document_scopes(user_id)
 
-    document = create_document(
-        filename=public_id,
-        original_filename=original_filename,
-        file_type=file_type,
-        uploaded_by=user_id
-    )
+    submit_ingestion_job(document_id, temp_path, file_type, user_id, content_hash, previous)
 
-    document.update({
-        "cloudinary_url": cloudinary_url,
-        "status": "processed"
-    })
+    return jsonify({
+        "success": True,
+        "msg": "Document revision accepted for processing" if previous else "Document accepted for processing",
+        "document_id": str(document_id),
+        "job_id": str(document_id),
+        "revision": bool(previous),
+        "status_url": f"/document/{document_id}/status"
+    }), 202
 
-    doc_result = documents_collection.insert_one(document)
-    document_id = doc_result.inserted_id
 
-    chunks = chunk_text(extracted_text)
+@document_bp.route("/<document_id>/status", methods=["GET"])
+@jwt_required()
+def document_status(document_id):
+    if not ObjectId.is_valid(document_id):
+        return jsonify({"success": False, "msg": "Invalid document id"}), 400
 
-    for index, chunk_text_data in enumerate(chunks):
-        chunks_collection.insert_one(
-            document_chunk(
-                document_id=document_id,
-                chunk_index=index,
-                text=chunk_text_data
-            )
-        )
+    claims = get_jwt()
+    user_id = get_jwt_identity()
 
-    documents_collection.update_one(
-        {"_id": document_id},
-        {
-            "$set": {
-                "chunk_count": len(chunks),
-                "status": "processed"
-            }
-        }
+    document = documents_collection.find_one(
+        {"_id": ObjectId(document_id)},
+        {"uploaded_by": 1, "status": 1, "progress": 1, "chunk_count": 1, "error": 1}
     )
 
+    if not document or (
+        claims.get("role") != "admin" and str(document["uploaded_by"]) != user_id
+    ):
+        return jsonify({"success": False, "msg": "Document not found"}), 404
+
     return jsonify({
         "success": True,
-        "msg": "Document uploaded successfully",
-        "document_id": str(document_id),
-        "file_url": cloudinary_url
-    }), 201
+        "document_id": document_id,
+        "status": document.get("status"),
+        "chunk_count": document.get("chunk_count", 0),
+        "progress": document.get("progress", {}),
+        "error": document.get("error")
+    }), 200
 
 
 @document_bp.route("/list", methods=["GET"])
@@ -166,6 +248,7 @@ def search_query():
 
     query = data["query"]
     top_k = data.get("top_k", 5)
+    mode = data.get("mode")
 
     claims = get_jwt()
     role = claims.get("role")
@@ -175,7 +258,8 @@ def search_query():
         query,
         top_k=top_k,
         user_id=user_id,
-        is_admin=(role == "admin")
+        is_admin=(role == "admin"),
+        mode=mode
     )
 
     return jsonify({"success": True, "results": results}), 200
@@ -192,17 +276,21 @@ def ask_question():
     user_id = get_jwt_identity()
     query = data["query"]
     top_k = data.get("top_k", 1)
+    mode = data.get("mode") or RETRIEVAL_MODE
     session_id = data.get("session_id")
 
     if not session_id:
         session = create_chat_session(user_id=user_id)
         result = chat_sessions.insert_one(session)
         session_id = str(result.inserted_id)
+        record_session(session)
+
+    stream = bool(data.get("stream"))
 
     if is_small_talk(query):
-        answer = "Hi there. Ask me something based on your uploaded documents and I’ll help."
+        answer = SMALL_TALK_ANSWER
 
-        messages.insert_one(
+        _save_message(
             create_message(
                 session_id=session_id,
                 user_id=user_id,
@@ -212,101 +300,284 @@ def ask_question():
             )
         )
 
+        if stream:
+            return _event_stream_response(
+                _static_answer_events(session_id, answer, [])
+            )
+
         return jsonify({
             "success": True,
             "session_id": session_id,
             "answer": answer,
             "sources": []
         }), 200
-    messages.insert_one(
-        create_message(
-            session_id=session_id,
-            user_id=user_id,
-            role="user",
-            content=query
-        )
-    )
-    chat_history = ""
-    recent_messages = get_recent_messages(
-        messages_collection=messages,
+    claims = get_jwt()
+    role = claims.get("role")
+    is_admin = role == "admin"
+
+    # History, the query embedding, the ACL lookup and the cache version
+    # don't depend on each other, so they are fetched concurrently.
+    user_message = create_message(
         session_id=session_id,
-        limit=6
+        user_id=user_id,
+        role="user",
+        content=query
     )
-    chat_history = format_chat_history(recent_messages)
+    scope = cache_scope(user_id, is_admin)
+    timings = StageTimings(ask_executor)
 
-    claims = get_jwt()
-    role = claims.get("role")
+    stages = {"save_question": (_save_message, user_message)}
+    if conversation_summary_store is not None:
+        stages["history"] = (
+            conversation_summary_store.history, messages, session_id, HISTORY_LIMIT - 1, user_message["created_at"]
+        )
+    else:
+        stages["history"] = (
+            get_recent_messages, messages, session_id, HISTORY_LIMIT - 1, user_message["created_at"]
+        )
+    # Lexical retrieval needs no query embedding, so it also bypasses the answer cache.
+    if mode != "lexical":
+        stages["embed_query"] = (embed_text, query)
+    stages["acl_lookup"] = (visible_document_ids, user_id, is_admin)
+    if answer_cache is not None and mode != "lexical":
+        stages["cache_version"] = (answer_cache.scope_version, scope)
+
+    results = timings.overlap(stages)
+
+    summary = None
+    history = results["history"]
+    if conversation_summary_store is not None:
+        summary, history = history
+
+    recent_messages = history + [user_message]
+    chat_history = format_chat_history(recent_messages, summary["summary"] if summary else None)
+    query_vector = results.get("embed_query")
+
+    # Only standalone questions are cached; follow-ups depend on the conversation.
+    cache_context = None
+    if "cache_version" in results and len(recent_messages) <= 1 and summary is None:
+        version = results["cache_version"]
+        cache_context = (scope, version, query_vector)
+
+        cached = timings.run("cache_lookup", answer_cache.lookup, scope, version, query_vector)
+        if cached:
+            timings.defer(
+                "persist_answer",
+                write_executor,
+                _persist_answer,
+                user_id,
+                session_id,
+                {"answer": cached["answer"], "sources": cached["sources"], "usage": {
+                    "input_tokens": 0, "output_tokens": 0, "total_tokens": 0, "model": cached["model"]
+                }},
+                None,
+                cached["cost"]
+            )
 
-    retrieved_chunks = retrieve_chunks(
+            if stream:
+                return _event_stream_response(
+                    _static_answer_events(session_id, cached["answer"], cached["sources"], timings)
+                )
+
+            return jsonify({
+                "success": True,
+                "session_id": session_id,
+                "answer": cached["answer"],
+                "sources": cached["sources"],
+                "cached": True,
+                "timings": timings.report()
+            }), 200
+
+    retrieved_chunks = timings.run(
+        "retrieve",
+        retrieve_chunks,
         query,
         top_k=top_k,
         user_id=user_id,
-        is_admin=(role == "admin")
+        is_admin=is_admin,
+        query_vector=query_vector,
+        mode=mode,
+        allowed_document_ids=results.get("acl_lookup")
     )
 
-    answer_payload = generate_answer(
+    if stream:
+        return _event_stream_response(
+            _streamed_answer_events(
+                user_id, session_id, query, retrieved_chunks, chat_history, cache_context, timings
+            )
+        )
+
+    answer_payload = timings.run(
+        "generate",
+        generate_answer,
         query=query,
         retrieved_chunks=retrieved_chunks,
         chat_history=chat_history
     )
 
-    usage = answer_payload.get("usage")
+    timings.defer(
+        "persist_answer", write_executor, _persist_answer, user_id, session_id, answer_payload, cache_context
+    )
 
-    if usage:
-        INPUT_TOKEN_PRICE = 0.0001 / 1000
-        OUTPUT_TOKEN_PRICE = 0.0002 / 1000
+    return jsonify({
+        "success": True,
+        "session_id": session_id,
+        "answer": answer_payload["answer"],
+        "sources": answer_payload["sources"],
+        "timings": timings.report()
+    }), 200
 
-        cost = (
-            usage["input_tokens"] * INPUT_TOKEN_PRICE +
-            usage["output_tokens"] * OUTPUT_TOKEN_PRICE
-        )
-        log = create_llm_usage_log(
-            user_id=user_id,
-            session_id=session_id,
-            model=usage["model"],
-            input_tokens=usage["input_tokens"],
-            output_tokens=usage["output_tokens"],
-            total_tokens=usage["total_tokens"],
-            cost=cost
-        )
 
-        try:
-            llm_usage_logs.insert_one(log)
-
-            user_usage.update_one(
-                {"user_id": ObjectId(user_id)},
-                {
-                    "$inc": {
-                        "total_tokens": usage["total_tokens"],
-                        "total_cost": round(cost, 6)
-                    },
-                    "$set": {
-                        "last_used": datetime.utcnow()
-                    }
-                },
-                upsert=True
+def _persist_answer(user_id, session_id, answer_payload, cache_context=None, cost_saved=None):
+    try:
+        if cost_saved is not None:
+            _record_usage(user_id, session_id, answer_payload["usage"], cache_hit=True, cost_saved=cost_saved)
+        else:
+            cost = _record_usage(user_id, session_id, answer_payload.get("usage"))
+            _cache_answer(cache_context, answer_payload, cost)
+
+        _save_answer(user_id, session_id, answer_payload["answer"], answer_payload["sources"])
+
+        if conversation_summary_store is not None:
+            conversation_summary_store.schedule_update(
+                messages,
+                session_id,
+                lambda usage: _record_usage(user_id, session_id, usage, endpoint="conversation_summary")
             )
-        except Exception as e:
-            print("LLM usage logging failed:", e)
+    except Exception as e:
+        print("Saving answer failed:", e)
+
+
+def _cache_answer(cache_context, answer_payload, cost):
+    if cache_context is None or not answer_payload["sources"] or not answer_payload.get("usage"):
+        return
+
+    scope, version, query_vector = cache_context
+    answer_cache.store(
+        scope,
+        version,
+        query_vector,
+        answer=answer_payload["answer"],
+        sources=answer_payload["sources"],
+        model=answer_payload["usage"]["model"],
+        cost=cost
+    )
+
+
+def _record_usage(user_id, session_id, usage, cache_hit=False, cost_saved=0.0, endpoint="/ask"):
+    if not usage:
+        return 0.0
 
-    messages.insert_one(
+    cost = (
+        usage["input_tokens"] * INPUT_TOKEN_PRICE +
+        usage["output_tokens"] * OUTPUT_TOKEN_PRICE
+    )
+    log = create_llm_usage_log(
+        user_id=user_id,
+        session_id=session_id,
+        model=usage["model"],
+        input_tokens=usage["input_tokens"],
+        output_tokens=usage["output_tokens"],
+        total_tokens=usage["total_tokens"],
+        cost=cost,
+        endpoint=endpoint,
+        cache_hit=cache_hit,
+        cost_saved=cost_saved
+    )
+
+    try:
+        write_buffer.insert(llm_usage_logs, log)
+        record_usage_rollups(log)
+
+        write_buffer.write(user_usage, UpdateOne(
+            {"user_id": ObjectId(user_id)},
+            {
+                "$inc": {
+                    "total_tokens": usage["total_tokens"],
+                    "total_cost": round(cost, 6),
+                    "cache_hits": int(cache_hit),
+                    "cost_saved": round(cost_saved, 6)
+                },
+                "$set": {
+                    "last_used": datetime.utcnow()
+                }
+            },
+            upsert=True
+        ))
+    except Exception as e:
+        print("LLM usage logging failed:", e)
+
+    return cost
+
+
+def _save_message(message):
+    write_buffer.insert(messages, message)
+    record_message(message)
+
+
+def _save_answer(user_id, session_id, answer, sources):
+    _save_message(
         create_message(
             session_id=session_id,
             user_id=user_id,
             role="assistant",
-            content=answer_payload["answer"],
-            sources=answer_payload["sources"]
+            content=answer,
+            sources=sources
         )
     )
 
-    chat_sessions.update_one(
+    write_buffer.write(chat_sessions, UpdateOne(
         {"_id": ObjectId(session_id)},
         {"$set": {"updated_at": datetime.utcnow()}}
+    ))
+
+
+def _sse(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload, default=str)}\n\n"
+
+
+def _event_stream_response(events):
+    return Response(
+        stream_with_context(events),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
 
-    return jsonify({
-        "success": True,
+
+def _static_answer_events(session_id, answer, sources, timings=None):
+    yield _sse("sources", {"session_id": session_id, "sources": sources})
+    yield _sse("token", {"content": answer})
+    yield _sse("done", {
         "session_id": session_id,
-        "answer": answer_payload["answer"],
-        "sources": answer_payload["sources"]
-    }), 200
+        "usage": None,
+        "timings": timings.report() if timings else None
+    })
+
+
+def _streamed_answer_events(user_id, session_id, query, retrieved_chunks, chat_history, cache_context=None, timings=None):
+    sources = get_sources(retrieved_chunks)
+    yield _sse("sources", {"session_id": session_id, "sources": sources})
+
+    answer_parts = []
+    usage = None
+
+    for event in stream_answer(query, retrieved_chunks, chat_history):
+        if event["type"] == "token":
+            answer_parts.append(event["content"])
+            yield _sse("token", {"content": event["content"]})
+        elif event["type"] == "usage":
+            usage = event["usage"]
+
+    answer_payload = {"answer": "".join(answer_parts).strip(), "sources": sources, "usage": usage}
+    if timings is None:
+        _persist_answer(user_id, session_id, answer_payload, cache_context)
+    else:
+        timings.defer(
+            "persist_answer", write_executor, _persist_answer, user_id, session_id, answer_payload, cache_context
+        )
+
+    yield _sse("done", {
+        "session_id": session_id,
+        "usage": usage,
+        "timings": timings.report() if timings else None
+    })
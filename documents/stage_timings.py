@@ -0,0 +1,59 @@
+import contextvars
+import time
+
+from monitoring.metrics import observe_stage
+
+
+# Wall-clock timings for the stages of one request. Stages run through
+# overlap() may share a thread pool; for those it also records how much
+# time running them together saved over running them one after another.
+class StageTimings:
+    def __init__(self, executor=None):
+        self.executor = executor
+        self.stages = {}
+        self.saved = {}
+        self.deferred = []
+        self._started = time.perf_counter()
+
+    def run(self, name, fn, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.stages[name] = round(elapsed * 1000, 2)
+            observe_stage(name, elapsed)
+
+    def overlap(self, calls):
+        if self.executor is None:
+            return {name: self.run(name, *call) for name, call in calls.items()}
+
+        futures = {
+            name: self.executor.submit(contextvars.copy_context().run, self.run, name, *call)
+            for name, call in calls.items()
+        }
+        results = {name: future.result() for name, future in futures.items()}
+
+        # Every stage except the slowest one is hidden behind it
+        slowest = max(calls, key=lambda name: self.stages[name])
+        for name in calls:
+            if name != slowest:
+                self.saved[name] = self.stages[name]
+
+        return results
+
+    # Work the response doesn't depend on, such as persistence after an answer
+    def defer(self, name, executor, fn, *args):
+        if executor is None:
+            return self.run(name, fn, *args)
+
+        self.deferred.append(name)
+        return executor.submit(contextvars.copy_context().run, self.run, name, fn, *args)
+
+    def report(self):
+        return {
+            "total_ms": round((time.perf_counter() - self._started) * 1000, 2),
+            "stages_ms": dict(self.stages),
+            "saved_ms": dict(self.saved),
+            "deferred": list(self.deferred)
+        }
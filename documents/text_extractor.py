@@ -1,20 +1,204 @@
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+from concurrent.futures import CancelledError, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
 import pdfplumber
 
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", 0))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", 8))
+PDF_PAGE_TIMEOUT = float(os.getenv("PDF_PAGE_TIMEOUT", 30))
+
+_pdf_pool = None
+_pdf_pool_workers = None
+_pdf_pool_lock = threading.Lock()
+
+
+class PageTimeout(Exception):
+    pass
+
+
 def extract_text_from_txt(file_path):
     with open(file_path, "r", encoding="utf-8", errors="ignore") as file:
         return file.read()
-    
-def extract_text_from_pdf(file_path):
-    
-    text=[]
 
+def extract_pages_from_pdf(file_path):
     with pdfplumber.open(file_path) as pdf:
         for page in pdf.pages:
-            page_text=page.extract_text()
-            if page_text:
-                text.append(page_text)
+            yield page.extract_text() or ""
+
+
+def _report_worker_pid(pids):
+    pids.put(os.getpid())
+
+
+def _raise_page_timeout(signum, frame):
+    raise PageTimeout()
+
+
+def _extract_page_range(file_path, start, end, page_timeout):
+    # Runs in a pool process, where SIGALRM can interrupt a stuck page
+    use_alarm = page_timeout > 0 and hasattr(signal, "setitimer")
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _raise_page_timeout)
+
+    texts = []
+    skipped = []
+    with pdfplumber.open(file_path, pages=list(range(start + 1, end + 1))) as pdf:
+        for page in pdf.pages:
+            try:
+                if use_alarm:
+                    signal.setitimer(signal.ITIMER_REAL, page_timeout)
+                texts.append(page.extract_text() or "")
+            except PageTimeout:
+                print(f"PDF page {page.page_number} timed out after {page_timeout}s, skipping")
+                texts.append("")
+                skipped.append(page.page_number)
+            finally:
+                if use_alarm:
+                    signal.setitimer(signal.ITIMER_REAL, 0)
+
+    return texts, skipped
+
+
+def _get_pdf_pool():
+    global _pdf_pool, _pdf_pool_workers
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            context = multiprocessing.get_context("spawn")
+            # Workers report their pids so a hung pool can be torn down
+            _pdf_pool_workers = context.Queue()
+            _pdf_pool = ProcessPoolExecutor(
+                max_workers=PDF_EXTRACT_WORKERS,
+                mp_context=context,
+                initializer=_report_worker_pid,
+                initargs=(_pdf_pool_workers,)
+            )
+        return _pdf_pool
+
+
+def _drain_worker_pids(workers):
+    pids = []
+    while True:
+        try:
+            pids.append(workers.get_nowait())
+        except queue.Empty:
+            return pids
 
-    return "\n".join(text)
+
+def _reset_pdf_pool(pool):
+    global _pdf_pool, _pdf_pool_workers
+    with _pdf_pool_lock:
+        if _pdf_pool is not pool:
+            return
+        workers = _pdf_pool_workers
+        _pdf_pool = None
+        _pdf_pool_workers = None
+
+    # A page stuck in C code ignores SIGALRM; its worker has to be killed
+    for pid in _drain_worker_pids(workers):
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+# Page numbers that could not be extracted are appended to failures, when given
+def extract_pages_from_pdf_parallel(file_path, pages_per_task=PDF_PAGES_PER_TASK, page_timeout=PDF_PAGE_TIMEOUT, failures=None):
+    if failures is None:
+        failures = []
+
+    with pdfplumber.open(file_path) as pdf:
+        total_pages = len(pdf.pages)
+
+    if total_pages <= pages_per_task:
+        yield from extract_pages_from_pdf(file_path)
+        return
+
+    ranges = [
+        (start, min(start + pages_per_task, total_pages))
+        for start in range(0, total_pages, pages_per_task)
+    ]
+
+    pool = _get_pdf_pool()
+    futures = [
+        pool.submit(_extract_page_range, file_path, start, end, page_timeout)
+        for start, end in ranges
+    ]
+    # The pool each range was last submitted to, and crashes seen per range
+    pools = [pool] * len(ranges)
+    crashes = [0] * len(ranges)
+
+    def replace_pool(broken, first):
+        _reset_pdf_pool(broken)
+        fresh = _get_pdf_pool()
+        for later in range(first, len(ranges)):
+            future = futures[later]
+            # Ranges still queued on the old pool were cancelled with it
+            if pools[later] is broken and (
+                future.cancelled() or not future.done() or future.exception() is not None
+            ):
+                futures[later] = fresh.submit(_extract_page_range, file_path, *ranges[later], page_timeout)
+                pools[later] = fresh
+        return fresh
+
+    try:
+        # Ranges are yielded in page order as soon as each one is ready
+        position = 0
+        while position < len(ranges):
+            start, end = ranges[position]
+            try:
+                texts, skipped = futures[position].result(
+                    timeout=page_timeout * (end - start) + 30 if page_timeout > 0 else None
+                )
+            except (FutureTimeoutError, BrokenProcessPool, CancelledError) as e:
+                broken = pools[position]
+                # The pool is shared: when another upload's timeout replaced
+                # it, this range is simply run again on the new one. A range
+                # that timed out itself, or crashed its worker twice, is lost.
+                if not isinstance(e, FutureTimeoutError) and broken is not _pdf_pool:
+                    replace_pool(broken, position)
+                    continue
+                if not isinstance(e, FutureTimeoutError):
+                    crashes[position] += 1
+                    if crashes[position] < 2:
+                        replace_pool(broken, position)
+                        continue
+
+                print(f"PDF pages {start + 1}-{end} could not be extracted:", repr(e))
+                failures.extend(range(start + 1, end + 1))
+                yield from [""] * (end - start)
+                replace_pool(broken, position + 1)
+            else:
+                failures.extend(skipped)
+                yield from texts
+            position += 1
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def extract_text_from_pdf(file_path):
+    return "\n".join(
+        page_text for page_text in extract_pages(file_path, "pdf") if page_text
+    )
+
+
+def extract_pages(file_path, file_type, failures=None):
+    if file_type == "txt":
+        yield extract_text_from_txt(file_path)
+        return
+    if file_type == "pdf":
+        if PDF_EXTRACT_WORKERS > 1:
+            yield from extract_pages_from_pdf_parallel(file_path, failures=failures)
+        else:
+            yield from extract_pages_from_pdf(file_path)
+        return
+    raise ValueError(f"Unsupported file type:{file_type}")
 
 
 def extract_text(file_path,file_type):
@@ -22,4 +206,4 @@ def extract_text(file_path,file_type):
         return extract_text_from_txt(file_path)
     if file_type == "pdf":
         return extract_text_from_pdf(file_path)
-    raise ValueError(f"Unsupported file type:{file_type}")
\ No newline at end of file
+    raise ValueError(f"Unsupported file type:{file_type}")
@@ -10,7 +10,9 @@ def create_llm_usage_log(
     output_tokens,
     total_tokens,
     cost,
-    endpoint="/ask"
+    endpoint="/ask",
+    cache_hit=False,
+    cost_saved=0.0
 ):
     return {
         "user_id": ObjectId(user_id),
@@ -21,5 +23,7 @@ def create_llm_usage_log(
         "output_tokens": output_tokens,
         "total_tokens": total_tokens,
         "cost": round(cost, 6),
+        "cache_hit": cache_hit,
+        "cost_saved": round(cost_saved, 6),
         "created_at": datetime.utcnow()
     }
@@ -0,0 +1,180 @@
+import argparse
+from datetime import datetime
+
+from pymongo import UpdateOne
+
+from database.mongo import llm_usage_logs, llm_usage_rollups
+from database.write_buffer import write_buffer
+
+GRANULARITIES = ("hour", "day")
+TOTALS_ID = "totals"
+BACKFILL_BATCH_SIZE = 1000
+
+# Requests and cache hits count /ask calls only; background calls such as
+# conversation summaries still add their tokens and cost
+ASK_ENDPOINT = "/ask"
+
+_COUNTERS = ("requests", "input_tokens", "output_tokens", "total_tokens", "cost", "cache_hits", "cost_saved")
+
+
+def bucket_start(timestamp, granularity):
+    if granularity == "hour":
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _bucket_key(granularity, bucket, user_id, model):
+    return f"{granularity}:{bucket.isoformat()}:{user_id}:{model}"
+
+
+def _log_counters(log):
+    is_ask = log.get("endpoint", ASK_ENDPOINT) == ASK_ENDPOINT
+    return {
+        "requests": int(is_ask),
+        "input_tokens": log["input_tokens"],
+        "output_tokens": log["output_tokens"],
+        "total_tokens": log["total_tokens"],
+        "cost": log["cost"],
+        "cache_hits": int(is_ask and log.get("cache_hit", False)),
+        "cost_saved": log.get("cost_saved", 0.0)
+    }
+
+
+# One rollup document per (granularity, bucket, user, model). Usage logging
+# increments the hour and day buckets of every log it writes, so range
+# queries read a bounded number of buckets instead of the raw log.
+def rollup_updates(log):
+    counters = _log_counters(log)
+    updates = []
+
+    for granularity in GRANULARITIES:
+        bucket = bucket_start(log["created_at"], granularity)
+        updates.append(UpdateOne(
+            {"_id": _bucket_key(granularity, bucket, log["user_id"], log["model"])},
+            {
+                "$inc": counters,
+                "$setOnInsert": {
+                    "granularity": granularity,
+                    "bucket": bucket,
+                    "user_id": log["user_id"],
+                    "model": log["model"]
+                }
+            },
+            upsert=True
+        ))
+
+    # All-time totals for the summary endpoint
+    updates.append(UpdateOne({"_id": TOTALS_ID}, {"$inc": counters}, upsert=True))
+
+    return updates
+
+
+def usage_totals():
+    # Until a backfill has folded in the logs written before rollups existed,
+    # the running totals are partial and the raw log is summed instead.
+    totals = llm_usage_rollups.find_one({"_id": TOTALS_ID, "backfilled": True})
+    if totals is None:
+        is_ask = {"$eq": [{"$ifNull": ["$endpoint", ASK_ENDPOINT]}, ASK_ENDPOINT]}
+        totals = next(llm_usage_logs.aggregate([
+            {"$group": {
+                "_id": None,
+                "requests": {"$sum": {"$cond": [is_ask, 1, 0]}},
+                "input_tokens": {"$sum": "$input_tokens"},
+                "output_tokens": {"$sum": "$output_tokens"},
+                "total_tokens": {"$sum": "$total_tokens"},
+                "cost": {"$sum": "$cost"},
+                "cache_hits": {"$sum": {"$cond": [{"$and": [is_ask, "$cache_hit"]}, 1, 0]}},
+                "cost_saved": {"$sum": {"$ifNull": ["$cost_saved", 0]}}
+            }}
+        ]), {})
+
+    return {counter: totals.get(counter, 0) for counter in _COUNTERS}
+
+
+def record_usage_rollups(log):
+    for update in rollup_updates(log):
+        write_buffer.write(llm_usage_rollups, update)
+
+
+def usage_timeseries(granularity, start, end, user_id=None, model=None, group_by=None):
+    query = {
+        "granularity": granularity,
+        "bucket": {"$gte": bucket_start(start, granularity), "$lt": end}
+    }
+    if user_id is not None:
+        query["user_id"] = user_id
+    if model is not None:
+        query["model"] = model
+
+    series = {}
+    for rollup in llm_usage_rollups.find(query, {"_id": 0}).sort("bucket", 1):
+        group = str(rollup[group_by]) if group_by else None
+        point = series.setdefault((rollup["bucket"], group), {
+            "bucket": rollup["bucket"],
+            **({group_by: group} if group_by else {}),
+            **{counter: 0 for counter in _COUNTERS}
+        })
+        for counter in _COUNTERS:
+            point[counter] += rollup.get(counter, 0)
+
+    points = list(series.values())
+    for point in points:
+        point["cost"] = round(point["cost"], 6)
+        point["cost_saved"] = round(point["cost_saved"], 6)
+
+    return points
+
+
+def backfill_rollups(until=None):
+    # Rebuilds every bucket from the raw log. Buckets are overwritten rather
+    # than incremented, so it can be re-run; run it while usage logging is
+    # quiet or restrict it to complete buckets with --until.
+    query = {"created_at": {"$lt": until}} if until else {}
+    totals = {}
+    all_time = {counter: 0 for counter in _COUNTERS}
+
+    for log in llm_usage_logs.find(query).batch_size(BACKFILL_BATCH_SIZE):
+        counters = _log_counters(log)
+        for counter, value in counters.items():
+            all_time[counter] += value
+        for granularity in GRANULARITIES:
+            bucket = bucket_start(log["created_at"], granularity)
+            key = _bucket_key(granularity, bucket, log["user_id"], log["model"])
+            rollup = totals.setdefault(key, {
+                "granularity": granularity,
+                "bucket": bucket,
+                "user_id": log["user_id"],
+                "model": log["model"],
+                **{counter: 0 for counter in _COUNTERS}
+            })
+            for counter, value in counters.items():
+                rollup[counter] += value
+
+    updates = [
+        UpdateOne({"_id": key}, {"$set": rollup}, upsert=True)
+        for key, rollup in totals.items()
+    ]
+    for start in range(0, len(updates), BACKFILL_BATCH_SIZE):
+        llm_usage_rollups.bulk_write(updates[start:start + BACKFILL_BATCH_SIZE], ordered=False)
+
+    # With --until, logs after it were already counted as they were written
+    if until:
+        for log in llm_usage_logs.find({"created_at": {"$gte": until}}).batch_size(BACKFILL_BATCH_SIZE):
+            for counter, value in _log_counters(log).items():
+                all_time[counter] += value
+    llm_usage_rollups.update_one(
+        {"_id": TOTALS_ID},
+        {"$set": {**all_time, "backfilled": True}},
+        upsert=True
+    )
+
+    return len(updates)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild LLM usage rollups from llm_usage_logs")
+    parser.add_argument("--until", help="only logs before this UTC time, e.g. 2025-01-01T00:00:00")
+    args = parser.parse_args()
+
+    until = datetime.fromisoformat(args.until) if args.until else None
+    print("Rollup buckets written:", backfill_rollups(until))
@@ -0,0 +1,110 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from database.mongo import documents_collection
+from database.scope_versions import cache_scope, on_scope_change, scope_version
+
+ALLOWED_DOCUMENTS_CACHE_SIZE = int(os.getenv("ALLOWED_DOCUMENTS_CACHE_SIZE", 10000))
+
+
+# Sorted array of raw 12-byte ObjectIds. Membership is a binary search, and
+# a user with thousands of documents costs 12 bytes per id instead of a set
+# of Python strings.
+class DocumentIdSet:
+    def __init__(self, document_ids):
+        self._ids = np.unique(
+            np.array([ObjectId(d).binary for d in document_ids], dtype="S12")
+        )
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        return (str(ObjectId(raw)) for raw in self._ids.tolist())
+
+    def __contains__(self, document_id):
+        try:
+            raw = ObjectId(document_id).binary
+        except (InvalidId, TypeError):
+            return False
+
+        position = np.searchsorted(self._ids, raw)
+        return position < len(self._ids) and self._ids[position] == raw
+
+    @property
+    def nbytes(self):
+        return self._ids.nbytes
+
+
+# Each scope's active, permitted document ids, reused until the scope
+# version is bumped by an upload, a revision or an admin toggle.
+class AllowedDocumentsCache:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, user_id, is_admin):
+        scope = cache_scope(user_id, is_admin)
+        version = scope_version(scope)
+
+        with self._lock:
+            entry = self._entries.get(scope)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(scope)
+                self.hits += 1
+                return entry[1]
+
+            self.misses += 1
+            if entry is not None:
+                self.stale += 1
+
+        document_query = {"is_active": True}
+        if not is_admin and user_id:
+            document_query["uploaded_by"] = user_id
+
+        document_ids = DocumentIdSet(
+            documents_collection.find(document_query, {"_id": 1}).distinct("_id")
+        )
+
+        with self._lock:
+            self._entries[scope] = (version, document_ids)
+            self._entries.move_to_end(scope)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+        return document_ids
+
+    def invalidate_scopes(self, scopes):
+        with self._lock:
+            for scope in scopes:
+                self._entries.pop(scope, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "document_ids": sum(len(ids) for _, ids in self._entries.values()),
+                "bytes": sum(ids.nbytes for _, ids in self._entries.values()),
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+allowed_documents = AllowedDocumentsCache(ALLOWED_DOCUMENTS_CACHE_SIZE)
+on_scope_change(allowed_documents.invalidate_scopes)
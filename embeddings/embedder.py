@@ -1,8 +1,101 @@
+import hashlib
+import math
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import ollama
 
-def embed_text(text: str) -> list[float]:
-    response = ollama.embeddings(
-        model="nomic-embed-text",
-        prompt=text
+from dotenv import load_dotenv
+load_dotenv()
+
+from embeddings.embedding_cache import cache_key, embedding_cache
+
+EMBED_MODEL = os.getenv("EMBED_MODEL", "nomic-embed-text")
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "ollama")
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 32))
+EMBED_MAX_WORKERS = int(os.getenv("EMBED_MAX_WORKERS", 4))
+
+# Local stand-in for Ollama, used to benchmark the pipeline offline
+FAKE_EMBED_DIM = int(os.getenv("FAKE_EMBED_DIM", 768))
+FAKE_EMBED_LATENCY_MS = float(os.getenv("FAKE_EMBED_LATENCY_MS", 0))
+
+embed_executor = ThreadPoolExecutor(
+    max_workers=EMBED_MAX_WORKERS,
+    thread_name_prefix="embed"
+)
+
+
+def _fake_embed_batch(texts: list[str]) -> list[list[float]]:
+    if FAKE_EMBED_LATENCY_MS:
+        time.sleep(FAKE_EMBED_LATENCY_MS / 1000)
+
+    vectors = []
+    for text in texts:
+        rng = random.Random(hashlib.sha256(text.encode("utf-8")).digest())
+        vector = [rng.gauss(0, 1) for _ in range(FAKE_EMBED_DIM)]
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        vectors.append([x / norm for x in vector])
+    return vectors
+
+
+def _ollama_embed_batch(texts: list[str]) -> list[list[float]]:
+    response = ollama.embed(
+        model=EMBED_MODEL,
+        input=texts
     )
-    return response["embedding"]
\ No newline at end of file
+    return response["embeddings"]
+
+
+def _embed_batch(texts: list[str]) -> list[list[float]]:
+    if EMBED_BACKEND == "fake":
+        return _fake_embed_batch(texts)
+    return _ollama_embed_batch(texts)
+
+
+def embed_text(text: str) -> list[float]:
+    return embed_texts([text])[0]
+
+
+def embed_texts(texts: list[str], batch_size: int = None, max_workers: int = None) -> list[list[float]]:
+    if not texts:
+        return []
+
+    if embedding_cache is None:
+        return _embed_uncached(texts, batch_size, max_workers)
+
+    model = f"{EMBED_BACKEND}:{EMBED_MODEL}"
+    keys = [cache_key(model, text) for text in texts]
+    cached = embedding_cache.get_many(keys)
+
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in cached and key not in missing:
+            missing[key] = text
+
+    if missing:
+        vectors = _embed_uncached(list(missing.values()), batch_size, max_workers)
+        computed = dict(zip(missing.keys(), vectors))
+        embedding_cache.put_many(computed)
+        cached.update(computed)
+
+    return [cached[key] for key in keys]
+
+
+def _embed_uncached(texts, batch_size=None, max_workers=None):
+    batch_size = batch_size or EMBED_BATCH_SIZE
+    batches = [
+        texts[start:start + batch_size]
+        for start in range(0, len(texts), batch_size)
+    ]
+
+    if len(batches) == 1 or max_workers == 1:
+        results = [_embed_batch(batch) for batch in batches]
+    elif max_workers:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            results = list(pool.map(_embed_batch, batches))
+    else:
+        results = list(embed_executor.map(_embed_batch, batches))
+
+    return [vector for batch in results for vector in batch]
@@ -0,0 +1,131 @@
+import array
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from dotenv import load_dotenv
+load_dotenv()
+
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", ".cache/embeddings.sqlite3")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", 200000))
+
+# SQLite caps the number of bound parameters per statement
+_LOOKUP_BATCH = 500
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(text.split())
+
+
+def cache_key(model: str, text: str) -> bytes:
+    return hashlib.sha256(
+        f"{model}\0{normalize_text(text)}".encode("utf-8")
+    ).digest()
+
+
+def _encode(vector) -> bytes:
+    return array.array("f", vector).tobytes()
+
+
+def _decode(blob: bytes) -> list[float]:
+    vector = array.array("f")
+    vector.frombytes(blob)
+    return vector.tolist()
+
+
+class EmbeddingCache:
+    def __init__(self, path: str, max_entries: int):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key BLOB PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)"
+        )
+        self._conn.commit()
+
+    def get_many(self, keys: list[bytes]) -> dict:
+        found = {}
+        if not keys:
+            return found
+
+        now = time.time()
+        with self._lock:
+            for start in range(0, len(keys), _LOOKUP_BATCH):
+                batch = keys[start:start + _LOOKUP_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = _decode(blob)
+
+            if found:
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+                self._conn.commit()
+
+            self.hits += len(found)
+            self.misses += len(set(keys)) - len(found)
+
+        return found
+
+    def put_many(self, items: dict):
+        if not items:
+            return
+
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, _encode(vector), now) for key, vector in items.items()]
+            )
+
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            overflow = entries - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN ("
+                    "SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (overflow,)
+                )
+                self.evictions += overflow
+
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": entries,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+embedding_cache = (
+    EmbeddingCache(EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_ENTRIES)
+    if EMBEDDING_CACHE_ENABLED else None
+)
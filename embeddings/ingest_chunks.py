@@ -1,46 +1,202 @@
-from embeddings.embedder import embed_text
+from embeddings.embedder import embed_texts
+from embeddings.embedding_cache import embedding_cache
 from embeddings.pinecone_client import index
-from pymongo import MongoClient
+from database.mongo import chunks_collection, documents_collection
+from monitoring.metrics import CHUNKS_EMBEDDED, span
+from pymongo import UpdateOne
+from bson import ObjectId
+from collections import Counter
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from uuid import uuid4
 import os
+import threading
 from dotenv import load_dotenv
 load_dotenv()
 
-client = MongoClient(os.getenv("MONGO_URI"))
-db = client["KnowledgeAssistant"]
-chunks_collection = db["document_chunks"]
 
-def ingest_chunks():
-    chunks = chunks_collection.find({"embedded": False})
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 256))
+UPSERT_BATCH_SIZE = 100
+DELETE_BATCH_SIZE = 1000
+METADATA_UPDATE_WORKERS = int(os.getenv("METADATA_UPDATE_WORKERS", 8))
+EMBED_LEASE_SECONDS = int(os.getenv("EMBED_LEASE_SECONDS", 300))
 
-    vectors = []
-    pending_updates= []
 
-    for chunk in chunks:
-        vector = embed_text(chunk["text"])
+def _access_metadata(document):
+    return {
+        "uploaded_by": str(document.get("uploaded_by")),
+        "is_active": document.get("is_active", True)
+    }
 
-        vectors.append({
+
+def _embed_and_upsert(chunks):
+    with span("ingest.embed"):
+        vectors = embed_texts([chunk["text"] for chunk in chunks])
+
+    with span("ingest.fetch_documents"):
+        documents = {
+            d["_id"]: _access_metadata(d)
+            for d in documents_collection.find(
+                {"_id": {"$in": list({chunk["document_id"] for chunk in chunks})}},
+                {"uploaded_by": 1, "is_active": 1}
+            )
+        }
+
+    records = [
+        {
             "id": str(chunk["_id"]),
             "values": vector,
             "metadata": {
                 "document_id": str(chunk["document_id"]),
-                "chunk_index": chunk["chunk_index"]
+                "chunk_index": chunk["chunk_index"],
+                **documents.get(chunk["document_id"], {"is_active": False})
             }
-        })
-        pending_updates.append(chunk["_id"])
-        if len(vectors) >= 50:
-            index.upsert(vectors=vectors)
-
-            chunks_collection.update_many(
-                {"_id": {"$in": pending_updates}},
-                {"$set": {"embedded": True}}
-            )
+        }
+        for chunk, vector in zip(chunks, vectors)
+    ]
 
-            vectors = []
-            pending_updates= []
+    with span("ingest.vector_upsert"):
+        for start in range(0, len(records), UPSERT_BATCH_SIZE):
+            index.upsert(vectors=records[start:start + UPSERT_BATCH_SIZE])
 
-    if vectors:
-        index.upsert(vectors=vectors)
+    with span("ingest.mark_embedded"):
         chunks_collection.update_many(
-            {"_id": {"$in": pending_updates}},
-            {"$set": {"embedded": True}}
+            {"_id": {"$in": [chunk["_id"] for chunk in chunks]}},
+            {
+                "$set": {"embedded": True},
+                "$unset": {"lease_owner": "", "lease_expires_at": ""}
+            }
+        )
+
+        embedded_per_document = Counter(chunk["document_id"] for chunk in chunks)
+        documents_collection.bulk_write([
+            UpdateOne({"_id": document_id}, {"$inc": {"progress.chunks_embedded": count}})
+            for document_id, count in embedded_per_document.items()
+        ], ordered=False)
+
+    CHUNKS_EMBEDDED.inc(len(chunks))
+
+
+def claim_chunks(owner, limit=INGEST_BATCH_SIZE):
+    now = datetime.utcnow()
+    claimable = {
+        "embedded": False,
+        "$or": [
+            {"lease_expires_at": None},
+            {"lease_expires_at": {"$lt": now}}
+        ]
+    }
+
+    candidate_ids = [
+        c["_id"]
+        for c in chunks_collection.find(claimable, {"_id": 1}).limit(limit)
+    ]
+    if not candidate_ids:
+        return []
+
+    # Each chunk is leased atomically; chunks another worker leased between
+    # the find and this update no longer match the claimable filter.
+    lease_token = f"{owner}:{uuid4().hex}"
+    chunks_collection.update_many(
+        {**claimable, "_id": {"$in": candidate_ids}},
+        {
+            "$set": {
+                "lease_owner": lease_token,
+                "lease_expires_at": now + timedelta(seconds=EMBED_LEASE_SECONDS)
+            }
+        }
+    )
+
+    return list(
+        chunks_collection.find(
+            {"lease_owner": lease_token, "embedded": False},
+            {"text": 1, "document_id": 1, "chunk_index": 1, "lease_owner": 1}
+        )
+    )
+
+
+@contextmanager
+def _renewed_lease(lease_token):
+    # Keeps a slow batch leased so another worker doesn't claim it again
+    stop = threading.Event()
+
+    def renew():
+        while not stop.wait(EMBED_LEASE_SECONDS / 3):
+            try:
+                chunks_collection.update_many(
+                    {"lease_owner": lease_token, "embedded": False},
+                    {"$set": {"lease_expires_at": datetime.utcnow() + timedelta(seconds=EMBED_LEASE_SECONDS)}}
+                )
+            except Exception as e:
+                print("Lease renewal failed:", e)
+
+    thread = threading.Thread(target=renew, name="lease-renewal", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def ingest_chunks(owner="inline", stop_event=None):
+    embedded = 0
+
+    while stop_event is None or not stop_event.is_set():
+        with span("ingest.claim"):
+            chunks = claim_chunks(owner)
+        if not chunks:
+            break
+
+        with _renewed_lease(chunks[0]["lease_owner"]):
+            _embed_and_upsert(chunks)
+        embedded += len(chunks)
+
+    if embedded and embedding_cache is not None:
+        print("Embedding cache:", embedding_cache.stats())
+
+    return embedded
+
+
+def update_document_metadata(document_id, metadata):
+    vector_ids = [
+        str(c["_id"])
+        for c in chunks_collection.find(
+            {"document_id": ObjectId(document_id), "embedded": True},
+            {"_id": 1}
         )
+    ]
+    if not vector_ids:
+        return 0
+
+    with ThreadPoolExecutor(max_workers=METADATA_UPDATE_WORKERS) as pool:
+        list(pool.map(
+            lambda vector_id: index.update(id=vector_id, set_metadata=metadata),
+            vector_ids
+        ))
+
+    return len(vector_ids)
+
+
+def update_chunk_indexes(moved):
+    with ThreadPoolExecutor(max_workers=METADATA_UPDATE_WORKERS) as pool:
+        list(pool.map(
+            lambda item: index.update(id=str(item[0]), set_metadata={"chunk_index": item[1]}),
+            moved
+        ))
+
+
+def delete_chunk_vectors(chunk_ids):
+    vector_ids = [str(chunk_id) for chunk_id in chunk_ids]
+    for start in range(0, len(vector_ids), DELETE_BATCH_SIZE):
+        index.delete(ids=vector_ids[start:start + DELETE_BATCH_SIZE])
+
+
+def sync_access_metadata():
+    for document in documents_collection.find({}, {"uploaded_by": 1, "is_active": 1}):
+        update_document_metadata(document["_id"], _access_metadata(document))
+
+
+if __name__ == "__main__":
+    sync_access_metadata()
@@ -0,0 +1,238 @@
+import math
+import os
+import re
+import threading
+import time
+from array import array
+from datetime import datetime, timedelta
+
+import numpy as np
+from dotenv import load_dotenv
+
+from database.indexes import CHUNK_DELETIONS_TTL
+from database.mongo import chunk_deletions, chunks_collection
+
+load_dotenv()
+
+
+BM25_K1 = float(os.getenv("BM25_K1", 1.2))
+BM25_B = float(os.getenv("BM25_B", 0.75))
+LEXICAL_SYNC_INTERVAL = float(os.getenv("LEXICAL_SYNC_INTERVAL", 30))
+# Share of removed rows at which postings are rebuilt without them
+LEXICAL_COMPACT_RATIO = float(os.getenv("LEXICAL_COMPACT_RATIO", 0.2))
+
+# Keeps identifiers such as ERR_CONN_RESET, v2.3.1 or x-api-key as one term
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[._-][a-z0-9]+)*")
+
+
+def tokenize(text: str) -> list[str]:
+    return _TOKEN_PATTERN.findall(text.lower()) if text else []
+
+
+# In-process inverted index over document_chunks. Each term maps to two
+# parallel packed arrays of chunk rows and term frequencies. A background
+# thread builds it and then keeps it in sync with writes from other
+# processes: a catch-up scan on created_at for new chunks and a read of
+# the chunk_deletions log for chunks deleted elsewhere. Removed rows are
+# skipped until they pass compact_ratio, then the postings are rebuilt.
+class LexicalIndex:
+    def __init__(self, k1=BM25_K1, b=BM25_B, sync_interval=LEXICAL_SYNC_INTERVAL, compact_ratio=LEXICAL_COMPACT_RATIO):
+        self.k1 = k1
+        self.b = b
+        self.sync_interval = sync_interval
+        self.compact_ratio = compact_ratio
+
+        self._lock = threading.RLock()
+        self._chunk_ids = []
+        self._document_ids = []
+        self._rows = {}
+        self._lengths = array("I")
+        self._postings = {}
+        self._deleted = set()
+        self._total_length = 0
+        self._synced_at = None
+        self._thread = None
+
+    def add(self, chunk_id, document_id, text):
+        chunk_id = str(chunk_id)
+        terms = tokenize(text)
+
+        frequencies = {}
+        for term in terms:
+            frequencies[term] = frequencies.get(term, 0) + 1
+
+        with self._lock:
+            if chunk_id in self._rows:
+                return
+
+            row = len(self._chunk_ids)
+            self._chunk_ids.append(chunk_id)
+            self._document_ids.append(str(document_id))
+            self._rows[chunk_id] = row
+            self._lengths.append(len(terms))
+            self._total_length += len(terms)
+
+            for term, frequency in frequencies.items():
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = (array("I"), array("H"))
+                    self._postings[term] = postings
+                postings[0].append(row)
+                postings[1].append(min(frequency, 65535))
+
+    def add_chunks(self, chunks):
+        for chunk in chunks:
+            self.add(chunk["_id"], chunk["document_id"], chunk["text"])
+
+    def remove_chunks(self, chunk_ids):
+        with self._lock:
+            for chunk_id in chunk_ids:
+                row = self._rows.get(str(chunk_id))
+                if row is not None and row not in self._deleted:
+                    self._deleted.add(row)
+                    self._total_length -= self._lengths[row]
+
+    # Tells the indexes of other processes about chunks deleted here
+    def log_deletions(self, chunk_ids):
+        chunk_deletions.insert_one({
+            "chunk_ids": [str(chunk_id) for chunk_id in chunk_ids],
+            "deleted_at": datetime.utcnow()
+        })
+
+    def _compact(self):
+        with self._lock:
+            if not self._deleted or len(self._deleted) < self.compact_ratio * len(self._chunk_ids):
+                return
+
+            deleted = np.fromiter(self._deleted, dtype=np.int64, count=len(self._deleted))
+            keep = np.ones(len(self._chunk_ids), dtype=bool)
+            keep[deleted] = False
+            # Old row -> new row, for the rows that stay
+            renumber = np.cumsum(keep, dtype=np.int64) - 1
+
+            for term, (rows, frequencies) in list(self._postings.items()):
+                old_rows = np.frombuffer(rows, dtype=np.uint32)
+                kept = keep[old_rows]
+                if kept.all():
+                    self._postings[term] = (
+                        array("I", renumber[old_rows].astype(np.uint32).tobytes()),
+                        frequencies
+                    )
+                    continue
+                if not kept.any():
+                    del self._postings[term]
+                    continue
+                self._postings[term] = (
+                    array("I", renumber[old_rows[kept]].astype(np.uint32).tobytes()),
+                    array("H", np.frombuffer(frequencies, dtype=np.uint16)[kept].tobytes())
+                )
+
+            rows = np.flatnonzero(keep)
+            self._chunk_ids = [self._chunk_ids[row] for row in rows]
+            self._document_ids = [self._document_ids[row] for row in rows]
+            self._rows = {chunk_id: row for row, chunk_id in enumerate(self._chunk_ids)}
+            self._lengths = array("I", np.frombuffer(self._lengths, dtype=np.uint32)[keep].tobytes())
+            self._deleted = set()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="lexical-sync", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self._sync()
+            except Exception as e:
+                print("Lexical index sync failed:", e)
+            time.sleep(self.sync_interval)
+
+    def _sync(self):
+        query = {}
+        if self._synced_at is not None:
+            # Overlap the window to tolerate clock skew between writers
+            query["created_at"] = {"$gte": self._synced_at - timedelta(minutes=1)}
+
+        started = datetime.utcnow()
+        with self._lock:
+            known_rows = len(self._chunk_ids)
+
+        self.add_chunks(
+            chunks_collection.find(query, {"text": 1, "document_id": 1})
+        )
+
+        # The first build only saw live chunks
+        if self._synced_at is not None:
+            if started - self._synced_at < timedelta(seconds=CHUNK_DELETIONS_TTL) - timedelta(minutes=5):
+                for deletion in chunk_deletions.find(
+                    {"deleted_at": {"$gte": self._synced_at - timedelta(minutes=1)}},
+                    {"chunk_ids": 1}
+                ):
+                    self.remove_chunks(deletion["chunk_ids"])
+            else:
+                # Out of sync for longer than the deletion log is kept
+                live = {str(c["_id"]) for c in chunks_collection.find({}, {"_id": 1})}
+                with self._lock:
+                    removed = [
+                        chunk_id for chunk_id in self._chunk_ids[:known_rows]
+                        if chunk_id not in live
+                    ]
+                self.remove_chunks(removed)
+
+        self._compact()
+        self._synced_at = started
+
+    def search(self, query, top_k=10, allowed_document_ids=None):
+        # Until the first build finishes, lexical results are partial
+        self.start()
+
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+
+        with self._lock:
+            live_count = len(self._chunk_ids) - len(self._deleted)
+            if not live_count:
+                return []
+
+            average_length = self._total_length / live_count
+            lengths = np.frombuffer(self._lengths, dtype=np.uint32)
+
+            rows_parts = []
+            score_parts = []
+            for term in terms:
+                postings = self._postings.get(term)
+                if postings is None:
+                    continue
+
+                rows = np.frombuffer(postings[0], dtype=np.uint32)
+                frequencies = np.frombuffer(postings[1], dtype=np.uint16).astype(np.float32)
+
+                idf = math.log(1 + (live_count - len(rows) + 0.5) / (len(rows) + 0.5))
+                norm = self.k1 * (1 - self.b + self.b * lengths[rows] / average_length)
+                rows_parts.append(rows)
+                score_parts.append(idf * frequencies * (self.k1 + 1) / (frequencies + norm))
+
+            if not rows_parts:
+                return []
+
+            candidates, inverse = np.unique(np.concatenate(rows_parts), return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate(score_parts))
+
+            results = []
+            for position in np.argsort(-scores, kind="stable"):
+                row = int(candidates[position])
+                if row in self._deleted:
+                    continue
+                if allowed_document_ids is not None and self._document_ids[row] not in allowed_document_ids:
+                    continue
+
+                results.append({"id": self._chunk_ids[row], "score": float(scores[position])})
+                if len(results) >= top_k:
+                    break
+
+            return results
+
+
+lexical_index = LexicalIndex()
@@ -0,0 +1,284 @@
+import atexit
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+LOCAL_INDEX_SAVE_INTERVAL = float(os.getenv("LOCAL_INDEX_SAVE_INTERVAL", 5))
+_INITIAL_CAPACITY = 1024
+
+
+# In-process stand-in for the Pinecone index, scored by cosine similarity.
+# Vectors live in one contiguous float32 matrix. A snapshot is vectors.npy
+# (memory-mapped on load) plus index.json with ids and metadata; the matrix
+# is only copied into writable memory on the first write.
+class LocalIndex:
+    def __init__(self, path: str, save_interval: float = LOCAL_INDEX_SAVE_INTERVAL):
+        self.path = path
+        self.save_interval = save_interval
+
+        self._lock = threading.RLock()
+        self._vectors = None
+        self._writable = False
+        self._size = 0
+        self._ids = []
+        self._rows = {}
+        self._metadata = []
+        self._columns = {}
+        self._dirty = False
+        self._last_save = time.monotonic()
+
+        self._load()
+        atexit.register(self.save)
+
+    @property
+    def _vectors_path(self):
+        return os.path.join(self.path, "vectors.npy")
+
+    @property
+    def _meta_path(self):
+        return os.path.join(self.path, "index.json")
+
+    def _load(self):
+        if not os.path.exists(self._vectors_path) or not os.path.exists(self._meta_path):
+            return
+
+        with open(self._meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+
+        self._vectors = np.load(self._vectors_path, mmap_mode="r")
+        self._ids = meta["ids"]
+        self._metadata = meta["metadata"]
+        self._rows = {vector_id: row for row, vector_id in enumerate(self._ids)}
+        self._size = len(self._ids)
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+
+            os.makedirs(self.path, exist_ok=True)
+
+            tmp_vectors = self._vectors_path + ".tmp"
+            with open(tmp_vectors, "wb") as f:
+                np.save(f, self._matrix())
+
+            tmp_meta = self._meta_path + ".tmp"
+            with open(tmp_meta, "w", encoding="utf-8") as f:
+                json.dump({"ids": self._ids, "metadata": self._metadata}, f)
+
+            os.replace(tmp_vectors, self._vectors_path)
+            os.replace(tmp_meta, self._meta_path)
+
+            self._dirty = False
+            self._last_save = time.monotonic()
+
+    def _mark_dirty(self):
+        self._columns = {}
+        self._dirty = True
+        if time.monotonic() - self._last_save >= self.save_interval:
+            self.save()
+
+    def _matrix(self):
+        if self._vectors is None:
+            return np.empty((0, 0), dtype=np.float32)
+        return self._vectors[:self._size]
+
+    def _reserve(self, extra: int, dim: int):
+        if self._vectors is not None and self._vectors.shape[1] != dim:
+            raise ValueError(
+                f"Vector dimension {dim} does not match index dimension {self._vectors.shape[1]}"
+            )
+
+        capacity = 0 if self._vectors is None else self._vectors.shape[0]
+        needed = self._size + extra
+
+        if self._writable and needed <= capacity:
+            return
+
+        new_capacity = max(needed, capacity * 2, _INITIAL_CAPACITY)
+        grown = np.empty((new_capacity, dim), dtype=np.float32)
+        if self._size:
+            grown[:self._size] = self._vectors[:self._size]
+
+        self._vectors = grown
+        self._writable = True
+
+    def _column(self, field):
+        column = self._columns.get(field)
+        if column is None:
+            column = np.empty(self._size, dtype=object)
+            column[:] = [meta.get(field) for meta in self._metadata]
+            self._columns[field] = column
+        return column
+
+    def _filter_mask(self, filter):
+        mask = np.ones(self._size, dtype=bool)
+
+        for field, condition in filter.items():
+            if field == "$and":
+                for clause in condition:
+                    mask &= self._filter_mask(clause)
+                continue
+            if field == "$or":
+                any_mask = np.zeros(self._size, dtype=bool)
+                for clause in condition:
+                    any_mask |= self._filter_mask(clause)
+                mask &= any_mask
+                continue
+
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+
+            column = self._column(field)
+            for op, value in condition.items():
+                if op == "$eq":
+                    mask &= column == value
+                elif op == "$ne":
+                    mask &= column != value
+                elif op in ("$in", "$nin"):
+                    values = set(value)
+                    member = np.fromiter((v in values for v in column), dtype=bool, count=self._size)
+                    mask &= member if op == "$in" else ~member
+                else:
+                    raise ValueError(f"Unsupported filter operator: {op}")
+
+        return mask
+
+    @staticmethod
+    def _normalize(values):
+        vectors = np.asarray(values, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def upsert(self, vectors, namespace=None):
+        if not vectors:
+            return {"upserted_count": 0}
+
+        records = [
+            v if isinstance(v, dict) else {"id": v[0], "values": v[1], "metadata": v[2] if len(v) > 2 else {}}
+            for v in vectors
+        ]
+        values = self._normalize([r["values"] for r in records])
+
+        with self._lock:
+            new_ids = {r["id"] for r in records if r["id"] not in self._rows}
+            self._reserve(len(new_ids), values.shape[1])
+
+            for record, vector in zip(records, values):
+                row = self._rows.get(record["id"])
+                if row is None:
+                    row = self._size
+                    self._size += 1
+                    self._ids.append(record["id"])
+                    self._metadata.append({})
+                    self._rows[record["id"]] = row
+
+                self._vectors[row] = vector
+                self._metadata[row] = dict(record.get("metadata") or {})
+
+            self._mark_dirty()
+
+        return {"upserted_count": len(records)}
+
+    def query(
+        self,
+        vector=None,
+        top_k=10,
+        include_metadata=False,
+        include_values=False,
+        filter=None,
+        namespace=None
+    ):
+        with self._lock:
+            if not self._size or top_k <= 0:
+                return {"matches": [], "namespace": namespace or ""}
+
+            matrix = self._matrix()
+            scores = matrix @ self._normalize(vector)
+
+            if filter:
+                candidates = np.flatnonzero(self._filter_mask(filter))
+            else:
+                candidates = np.arange(self._size)
+
+            k = min(top_k, len(candidates))
+            if k < len(candidates):
+                top = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+            else:
+                top = candidates
+            top = top[np.argsort(-scores[top], kind="stable")]
+
+            matches = []
+            for row in top:
+                match = {"id": self._ids[row], "score": float(scores[row])}
+                if include_metadata:
+                    match["metadata"] = dict(self._metadata[row])
+                if include_values:
+                    match["values"] = matrix[row].tolist()
+                matches.append(match)
+
+        return {"matches": matches, "namespace": namespace or ""}
+
+    def update(self, id, values=None, set_metadata=None, namespace=None):
+        with self._lock:
+            row = self._rows.get(id)
+            if row is None:
+                return {}
+
+            if values is not None:
+                self._reserve(0, self._vectors.shape[1])
+                self._vectors[row] = self._normalize(values)
+            if set_metadata:
+                self._metadata[row] = {**self._metadata[row], **set_metadata}
+
+            self._mark_dirty()
+
+        return {}
+
+    def delete(self, ids=None, delete_all=False, namespace=None):
+        with self._lock:
+            if delete_all:
+                self._vectors = None
+                self._writable = False
+                self._size = 0
+                self._ids = []
+                self._rows = {}
+                self._metadata = []
+                self._mark_dirty()
+                return {}
+
+            targets = [vector_id for vector_id in (ids or []) if vector_id in self._rows]
+            if not targets:
+                return {}
+
+            self._reserve(0, self._vectors.shape[1])
+
+            for vector_id in targets:
+                row = self._rows.pop(vector_id)
+                last = self._size - 1
+
+                if row != last:
+                    moved_id = self._ids[last]
+                    self._vectors[row] = self._vectors[last]
+                    self._ids[row] = moved_id
+                    self._metadata[row] = self._metadata[last]
+                    self._rows[moved_id] = row
+
+                self._ids.pop()
+                self._metadata.pop()
+                self._size -= 1
+
+            self._mark_dirty()
+
+        return {}
+
+    def describe_index_stats(self):
+        with self._lock:
+            return {
+                "dimension": 0 if self._vectors is None else self._vectors.shape[1],
+                "total_vector_count": self._size
+            }
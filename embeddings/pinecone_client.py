@@ -1,10 +1,17 @@
-from pinecone import Pinecone
-
 import os
 
 from dotenv import load_dotenv
 load_dotenv()
 
-pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "pinecone")
+
+if VECTOR_BACKEND == "local":
+    from embeddings.local_index import LocalIndex
+
+    index = LocalIndex(os.getenv("LOCAL_INDEX_PATH", ".cache/vector_index"))
+else:
+    from pinecone import Pinecone
+
+    pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
 
-index = pc.Index(os.getenv("PINECONE_INDEX_NAME"))
\ No newline at end of file
+    index = pc.Index(os.getenv("PINECONE_INDEX_NAME"))
@@ -1,28 +1,126 @@
 from embeddings.embedder import embed_text
 from embeddings.pinecone_client import index
-from pymongo import MongoClient
+from embeddings.lexical_index import lexical_index
+from embeddings.allowed_documents import allowed_documents
+from database.mongo import documents_collection, chunks_collection
+from monitoring.metrics import span
 from bson import ObjectId
+import numpy as np
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
-client = MongoClient(os.getenv("MONGO_URI"))
-db = client["KnowledgeAssistant"]
-chunks_collection = db["document_chunks"]
 
 
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "dense")
+HYBRID_CANDIDATE_MULTIPLIER = int(os.getenv("HYBRID_CANDIDATE_MULTIPLIER", 4))
+RRF_K = 60
+MMR_ENABLED = os.getenv("MMR_ENABLED", "true").lower() == "true"
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", 0.7))
+MMR_FETCH_MULTIPLIER = int(os.getenv("MMR_FETCH_MULTIPLIER", 4))
 
-def retrieve_chunks(query: str, top_k: int = 2, user_id=None, is_admin=False):
-    query_vector = embed_text(query)
 
-    search_response = index.query(
-        vector=query_vector,
-        top_k=top_k,
-        include_metadata=True
-    )
+def visible_document_ids(user_id, is_admin):
+    return allowed_documents.get(user_id, is_admin)
+
+
+def maximal_marginal_relevance(query_vector, candidate_vectors, top_k, lambda_mult=MMR_LAMBDA):
+    candidates = np.array(candidate_vectors, dtype=np.float32)
+    candidates /= np.maximum(np.linalg.norm(candidates, axis=1, keepdims=True), 1e-12)
+    query = np.array(query_vector, dtype=np.float32)
+    query /= max(np.linalg.norm(query), 1e-12)
+
+    relevance = candidates @ query
+    similarity = candidates @ candidates.T
+
+    selected = [int(np.argmax(relevance))]
+    max_similarity = similarity[selected[0]].copy()
+
+    while len(selected) < min(top_k, len(candidates)):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarity
+        scores[selected] = -np.inf
+        chosen = int(np.argmax(scores))
+        selected.append(chosen)
+        max_similarity = np.maximum(max_similarity, similarity[chosen])
+
+    return selected
+
+
+def _dense_matches(query, query_vector, top_k, user_id, is_admin, diversify=MMR_ENABLED):
+    if query_vector is None:
+        with span("retrieve.embed_query"):
+            query_vector = embed_text(query)
+
+    vector_filter = {"is_active": {"$eq": True}}
+    if not is_admin and user_id:
+        vector_filter["uploaded_by"] = {"$eq": str(user_id)}
+
+    with span("retrieve.vector_query"):
+        search_response = index.query(
+            vector=query_vector,
+            top_k=top_k * MMR_FETCH_MULTIPLIER if diversify else top_k,
+            include_metadata=True,
+            include_values=diversify,
+            filter=vector_filter
+        )
 
     matches = search_response.get("matches", [])
+    if not diversify or len(matches) <= 1:
+        return matches[:top_k]
+
+    # Over-fetched candidates are re-ranked so near-duplicate chunks
+    # (e.g. overlapping neighbours) don't crowd out other evidence.
+    with span("retrieve.mmr"):
+        selected = maximal_marginal_relevance(
+            query_vector,
+            [match["values"] for match in matches],
+            top_k
+        )
+    return [matches[position] for position in selected]
+
+
+def _lexical_matches(query, top_k, user_id, is_admin, allowed_document_ids=None):
+    if allowed_document_ids is None:
+        allowed_document_ids = visible_document_ids(user_id, is_admin)
+
+    with span("retrieve.lexical_search"):
+        return lexical_index.search(
+            query,
+            top_k=top_k,
+            allowed_document_ids=allowed_document_ids
+        )
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    scores = {}
+    for ranking in rankings:
+        for rank, match in enumerate(ranking):
+            scores[match["id"]] = scores.get(match["id"], 0.0) + 1.0 / (k + rank + 1)
+
+    return [
+        {"id": chunk_id, "score": score}
+        for chunk_id, score in sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    ]
+
+
+def retrieve_chunks(query: str, top_k: int = 2, user_id=None, is_admin=False, query_vector=None, mode=None, allowed_document_ids=None):
+    mode = mode or RETRIEVAL_MODE
+    if allowed_document_ids is None:
+        with span("retrieve.acl_lookup"):
+            allowed_document_ids = visible_document_ids(user_id, is_admin)
+
+    if mode == "lexical":
+        matches = _lexical_matches(query, top_k, user_id, is_admin, allowed_document_ids)
+    elif mode == "hybrid":
+        candidate_k = top_k * HYBRID_CANDIDATE_MULTIPLIER
+        matches = reciprocal_rank_fusion([
+            _dense_matches(query, query_vector, candidate_k, user_id, is_admin),
+            _lexical_matches(query, candidate_k, user_id, is_admin, allowed_document_ids)
+        ])[:top_k]
+    else:
+        matches = _dense_matches(query, query_vector, top_k, user_id, is_admin)
+
     if not matches:
         return []
 
@@ -30,35 +128,42 @@ def retrieve_chunks(query: str, top_k: int = 2, user_id=None, is_admin=False):
 
     chunk_query = {"_id": {"$in": chunk_ids}}
 
-    # 🔴 FIX IS HERE
-    if not is_admin and user_id:
-        allowed_doc_ids = db["documents"].find(
-            {"uploaded_by": user_id},   # ← NO ObjectId()
-            {"_id": 1}
-        ).distinct("_id")
-
-        chunk_query["document_id"] = {"$in": allowed_doc_ids}
-
-    chunks = list(
-        chunks_collection.find(
-            chunk_query,
-            {"text": 1, "document_id": 1, "chunk_index": 1}
+    with span("retrieve.fetch_chunks"):
+        chunks = list(
+            chunks_collection.find(
+                chunk_query,
+                {
+                    "text": 1,
+                    "document_id": 1,
+                    "chunk_index": 1,
+                    "token_count": 1,
+                    "page": 1,
+                    "char_start": 1,
+                    "char_end": 1
+                }
+            )
         )
-    )
 
     if not chunks:
         return []
 
-    chunk_map = {str(c["_id"]): c for c in chunks}
+    # Vector metadata is only eventually consistent with toggles, so the
+    # cached ACL has the final say on what a user may see.
+    chunk_map = {
+        str(c["_id"]): c
+        for c in chunks
+        if c["document_id"] in allowed_document_ids
+    }
 
     document_ids = list({c["document_id"] for c in chunks})
-    documents = {
-        str(d["_id"]): d["original_filename"]
-        for d in db["documents"].find(
-            {"_id": {"$in": document_ids}},
-            {"original_filename": 1}
-        )
-    }
+    with span("retrieve.fetch_documents"):
+        documents = {
+            str(d["_id"]): d["original_filename"]
+            for d in documents_collection.find(
+                {"_id": {"$in": document_ids}},
+                {"original_filename": 1}
+            )
+        }
 
     ordered_results = []
 
@@ -75,7 +180,11 @@ def retrieve_chunks(query: str, top_k: int = 2, user_id=None, is_admin=False):
             "document_name": documents.get(
                 str(chunk["document_id"]), "Unknown Document"
             ),
-            "chunk_index": chunk["chunk_index"]
+            "chunk_index": chunk["chunk_index"],
+            "token_count": chunk.get("token_count"),
+            "page": chunk.get("page"),
+            "char_start": chunk.get("char_start"),
+            "char_end": chunk.get("char_end")
         })
 
     return ordered_results
\ No newline at end of file
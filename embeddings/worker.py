@@ -0,0 +1,109 @@
+import argparse
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+
+from pymongo.errors import PyMongoError
+from dotenv import load_dotenv
+
+from database.indexes import ensure_indexes, ENSURE_INDEXES
+from embeddings.ingest_chunks import chunks_collection, ingest_chunks
+from embeddings.pinecone_client import VECTOR_BACKEND
+
+load_dotenv()
+
+EMBED_WORKER_POLL_INTERVAL = float(os.getenv("EMBED_WORKER_POLL_INTERVAL", 10))
+
+wake_event = threading.Event()
+
+
+def notify_new_chunks():
+    wake_event.set()
+
+
+def _watch_inserts(stop_event):
+    try:
+        with chunks_collection.watch(
+            [{"$match": {"operationType": "insert"}}],
+            max_await_time_ms=1000
+        ) as stream:
+            while not stop_event.is_set() and stream.alive:
+                if stream.try_next() is not None:
+                    wake_event.set()
+    except PyMongoError as e:
+        print("Change stream unavailable, falling back to polling:", e)
+
+
+def run_worker(stop_event, owner=None, watch=True):
+    owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+
+    if watch:
+        threading.Thread(target=_watch_inserts, args=(stop_event,), daemon=True).start()
+
+    while not stop_event.is_set():
+        wake_event.clear()
+        try:
+            ingest_chunks(owner=owner, stop_event=stop_event)
+        except Exception as e:
+            print("Embedding worker error:", e)
+        wake_event.wait(EMBED_WORKER_POLL_INTERVAL)
+
+    print(f"Embedding worker {owner} stopped")
+
+
+def _worker_process(number):
+    stop_event = threading.Event()
+
+    def shutdown(signum, frame):
+        stop_event.set()
+        wake_event.set()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    run_worker(stop_event, owner=f"{socket.gethostname()}:{os.getpid()}:{number}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embedding worker")
+    parser.add_argument("--procs", type=int, default=1)
+    args = parser.parse_args()
+
+    # Vectors written here would never reach the web process's index
+    if VECTOR_BACKEND == "local":
+        parser.error(
+            "the local vector index lives in the web process; "
+            "use EMBEDDING_WORKER=inline or a shared VECTOR_BACKEND"
+        )
+
+    if ENSURE_INDEXES:
+        ensure_indexes()
+
+    if args.procs == 1:
+        _worker_process(0)
+        return
+
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=_worker_process, args=(number,), name=f"embed-worker-{number}")
+        for number in range(args.procs)
+    ]
+    for process in processes:
+        process.start()
+
+    def forward(signum, frame):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from itertools import count
+
+import numpy as np
+from dotenv import load_dotenv
+
+from database.scope_versions import on_scope_change, scope_version
+
+load_dotenv()
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.95))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", 5000))
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", 86400))
+
+
+
+# Answers are held in process memory, one vector matrix per scope, and are
+# only served while their scope version is current.
+class AnswerCache:
+    def __init__(self, threshold, max_entries, ttl_seconds):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._ids = count()
+        self._entries = OrderedDict()
+        self._scopes = {}
+        self._matrices = {}
+
+    def scope_version(self, scope):
+        return scope_version(scope)
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        self._scopes[entry["scope"]].remove(entry_id)
+        self._matrices.pop(entry["scope"], None)
+
+    def _matrix(self, scope):
+        matrix = self._matrices.get(scope)
+        if matrix is None:
+            ids = list(self._scopes.get(scope, []))
+            vectors = [self._entries[entry_id]["vector"] for entry_id in ids]
+            matrix = (ids, np.vstack(vectors) if vectors else None)
+            self._matrices[scope] = matrix
+        return matrix
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, scope, version, query_vector):
+        query_vector = self._normalize(query_vector)
+        now = time.time()
+
+        with self._lock:
+            ids, matrix = self._matrix(scope)
+            if matrix is not None:
+                scores = matrix @ query_vector
+                for position in np.argsort(-scores):
+                    if scores[position] < self.threshold:
+                        break
+                    entry_id = ids[position]
+                    entry = self._entries[entry_id]
+                    if entry["version"] != version or now - entry["created_at"] > self.ttl_seconds:
+                        self._remove(entry_id)
+                        continue
+
+                    self._entries.move_to_end(entry_id)
+                    self.hits += 1
+                    return {**entry, "similarity": float(scores[position])}
+
+            self.misses += 1
+            return None
+
+    # Callers pass the version read before retrieval, so an answer built from
+    # documents that changed mid-request is stored as already stale.
+    def store(self, scope, version, query_vector, answer, sources, model, cost):
+        with self._lock:
+            entry_id = next(self._ids)
+            self._entries[entry_id] = {
+                "scope": scope,
+                "version": version,
+                "vector": self._normalize(query_vector),
+                "answer": answer,
+                "sources": sources,
+                "model": model,
+                "cost": cost,
+                "created_at": time.time()
+            }
+            self._scopes.setdefault(scope, set()).add(entry_id)
+            self._matrices.pop(scope, None)
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_scopes(self, scopes):
+        with self._lock:
+            for scope in scopes:
+                for entry_id in list(self._scopes.get(scope, [])):
+                    self._remove(entry_id)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+answer_cache = (
+    AnswerCache(ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL_SECONDS)
+    if ANSWER_CACHE_ENABLED else None
+)
+
+if answer_cache is not None:
+    on_scope_change(answer_cache.invalidate_scopes)
@@ -1,43 +1,109 @@
 import os
 import time
 from groq import Groq
+from llm.tokens import count_tokens, truncate_to_tokens
+from monitoring.metrics import observe_stage, record_llm_usage, span
 
 client = Groq(api_key=os.getenv("LLM_API"))
 
-MAX_CHARS_PER_CHUNK = 1000
-MAX_TOTAL_CONTEXT_CHARS = 2000
+MAX_CONTEXT_TOKENS = int(os.getenv("MAX_CONTEXT_TOKENS", 1024))
 MAX_TOKENS_TO_GENERATE = 256
+MODEL_NAME = "llama-3.1-8b-instant"
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", 200))
 
 
-def _trim_text(text: str, max_chars: int) -> str:
-    return text[:max_chars] if text else ""
+def _join_overlap(previous: str, following: str) -> str:
+    previous_words = previous.split()
+    following_words = following.split()
 
+    for size in range(min(len(previous_words), len(following_words)), 0, -1):
+        if previous_words[-size:] == following_words[:size]:
+            return " ".join(previous_words + following_words[size:])
 
-def generate_answer(query, retrieved_chunks, chat_history=""):
-    if not retrieved_chunks:
-        return {
-            "answer": "I do not know.",
-            "sources": []
-        }
+    return " ".join(previous_words + following_words)
+
+
+def _join_spans(previous, following):
+    if previous.get("char_end") is not None and following.get("char_start") is not None:
+        overlap = previous["char_end"] - following["char_start"]
+        if overlap >= 0:
+            return previous["text"] + following["text"][overlap:]
+        return previous["text"] + " " + following["text"]
 
-    # Build controlled context
+    # Chunks written before offsets were stored overlap by whole words
+    return _join_overlap(previous["text"], following["text"])
+
+
+def _merge_adjacent_chunks(retrieved_chunks):
+    # Consecutive chunks of a document overlap, so send each span only once.
+    # A merged span keeps the best retrieval rank of its members.
+    ranked = sorted(
+        enumerate(retrieved_chunks),
+        key=lambda item: (item[1]["document_id"], item[1]["chunk_index"])
+    )
+
+    spans = []
+    for rank, c in ranked:
+        last = spans[-1] if spans else None
+        if last and last["document_id"] == c["document_id"]:
+            if c["chunk_index"] == last["end_index"]:
+                continue
+            if c["chunk_index"] == last["end_index"] + 1:
+                last["text"] = _join_spans(last, c)
+                last["char_end"] = c.get("char_end")
+                last["end_index"] = c["chunk_index"]
+                last["rank"] = min(last["rank"], rank)
+                last["token_count"] = None
+                continue
+
+        spans.append({
+            "document_id": c["document_id"],
+            "start_index": c["chunk_index"],
+            "end_index": c["chunk_index"],
+            "text": c["text"],
+            "token_count": c.get("token_count"),
+            "char_start": c.get("char_start"),
+            "char_end": c.get("char_end"),
+            "rank": rank
+        })
+
+    return sorted(spans, key=lambda span: span["rank"])
+
+
+def build_context(retrieved_chunks, max_tokens=MAX_CONTEXT_TOKENS):
     context_parts = []
-    total_chars = 0
-    
+    remaining = max_tokens
 
-    for c in retrieved_chunks:
-        trimmed = _trim_text(c["text"], MAX_CHARS_PER_CHUNK)
-        block = f"[Chunk {c['chunk_index']}]\n{trimmed}"
+    for span in _merge_adjacent_chunks(retrieved_chunks):
+        if span["start_index"] == span["end_index"]:
+            header = f"[Chunk {span['start_index']}]"
+        else:
+            header = f"[Chunks {span['start_index']}-{span['end_index']}]"
 
-        if total_chars + len(block) > MAX_TOTAL_CONTEXT_CHARS:
-            break
+        header_tokens = count_tokens(header) + 1
+        text_tokens = span["token_count"]
+        if text_tokens is None:
+            text_tokens = count_tokens(span["text"])
 
-        context_parts.append(block)
-        total_chars += len(block)
+        text = span["text"]
+        if header_tokens + text_tokens > remaining:
+            if context_parts:
+                continue
+            text = truncate_to_tokens(text, remaining - header_tokens)
+            text_tokens = count_tokens(text)
+            if not text:
+                break
 
-    context = "\n\n".join(context_parts)
+        context_parts.append(f"{header}\n{text}")
+        remaining -= header_tokens + text_tokens
 
-    prompt = f"""
+    return "\n\n".join(context_parts)
+
+
+def build_prompt(query, retrieved_chunks, chat_history=""):
+    context = build_context(retrieved_chunks)
+
+    return f"""
     You are a helpful assistant that answers questions ONLY using the provided document context.
     Conversation history is provided ONLY to understand the question, not as a source of facts.
     If the answer is not in the document context, say "I do not know".
@@ -57,33 +123,130 @@ def generate_answer(query, retrieved_chunks, chat_history=""):
     - Cite sources using chunk_index
     """
 
+
+def get_sources(retrieved_chunks):
+    return [
+        {
+            "document_id": c["document_id"],
+            "chunk_index": c["chunk_index"]
+        }
+        for c in retrieved_chunks
+    ]
+
+
+def summarize_conversation(previous_summary, history):
+    prompt = f"""
+    Update the running summary of a conversation between a user and a document assistant.
+    Keep the questions asked, the facts given in answers and anything later questions may refer to.
+    Write at most {SUMMARY_MAX_TOKENS} tokens of plain prose.
+
+    CURRENT SUMMARY:
+    {previous_summary if previous_summary else "None"}
+
+    NEW MESSAGES:
+    {history}
+    """
+
+    with span("summary.llm_call"):
+        response = client.chat.completions.create(
+            model=MODEL_NAME,
+            messages=[
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0,
+            max_tokens=SUMMARY_MAX_TOKENS,
+        )
+
+    usage = _usage_payload(response.usage)
+    record_llm_usage(usage, "summary")
+
+    return {
+        "summary": response.choices[0].message.content.strip(),
+        "usage": usage
+    }
+
+
+def _usage_payload(usage):
+    return {
+        "input_tokens": usage.prompt_tokens,
+        "output_tokens": usage.completion_tokens,
+        "total_tokens": usage.total_tokens,
+        "model": MODEL_NAME
+    }
+
+
+def generate_answer(query, retrieved_chunks, chat_history=""):
+    if not retrieved_chunks:
+        return {
+            "answer": "I do not know.",
+            "sources": []
+        }
+
+    with span("generate.build_prompt"):
+        prompt = build_prompt(query, retrieved_chunks, chat_history)
+
     start = time.time()
 
-    response = client.chat.completions.create(
-        model="llama-3.1-8b-instant",
+    with span("generate.llm_call"):
+        response = client.chat.completions.create(
+            model=MODEL_NAME,
+            messages=[
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.2,
+            max_tokens=MAX_TOKENS_TO_GENERATE,
+        )
+    usage = _usage_payload(response.usage)
+    record_llm_usage(usage, "answer")
+
+    print("LLM inference time:", round(time.time() - start, 2), "seconds")
+
+    return {
+        "answer": response.choices[0].message.content.strip(),
+        "sources": get_sources(retrieved_chunks),
+        "usage": usage
+    }
+
+
+def stream_answer(query, retrieved_chunks, chat_history=""):
+    if not retrieved_chunks:
+        yield {"type": "token", "content": "I do not know."}
+        return
+
+    with span("stream.build_prompt"):
+        prompt = build_prompt(query, retrieved_chunks, chat_history)
+
+    started = time.perf_counter()
+    first_token = True
+
+    stream = client.chat.completions.create(
+        model=MODEL_NAME,
         messages=[
             {"role": "user", "content": prompt}
         ],
         temperature=0.2,
         max_tokens=MAX_TOKENS_TO_GENERATE,
+        stream=True,
     )
-    usage = response.usage
 
-    print("LLM inference time:", round(time.time() - start, 2), "seconds")
-
-    return {
-        "answer": response.choices[0].message.content.strip(),
-        "sources": [
-            {
-                "document_id": c["document_id"],
-                "chunk_index": c["chunk_index"]
-            }
-            for c in retrieved_chunks
-        ],
-        "usage": {
-            "input_tokens": usage.prompt_tokens,
-            "output_tokens": usage.completion_tokens,
-            "total_tokens": usage.total_tokens,
-            "model": "llama-3.1-8b-instant"
-        }
-    }
+    usage = None
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            if first_token:
+                observe_stage("stream.first_token", time.perf_counter() - started)
+                first_token = False
+            yield {"type": "token", "content": chunk.choices[0].delta.content}
+
+        # Groq reports usage on the final chunk under x_groq
+        chunk_usage = getattr(chunk, "usage", None) or getattr(
+            getattr(chunk, "x_groq", None), "usage", None
+        )
+        if chunk_usage:
+            usage = chunk_usage
+
+    observe_stage("stream.llm_call", time.perf_counter() - started)
+
+    if usage:
+        usage = _usage_payload(usage)
+        record_llm_usage(usage, "stream")
+        yield {"type": "usage", "usage": usage}
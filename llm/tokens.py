@@ -0,0 +1,39 @@
+import math
+import re
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception as e:
+    print("tiktoken unavailable, estimating token counts:", e)
+    _encoding = None
+
+# Rough BPE approximation used when the tiktoken vocabulary can't be loaded
+_PIECE_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def _estimate_piece(piece):
+    return max(1, math.ceil(len(piece) / 4))
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return sum(_estimate_piece(m.group()) for m in _PIECE_PATTERN.finditer(text))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    if not text or max_tokens <= 0:
+        return ""
+    if _encoding is not None:
+        tokens = _encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else _encoding.decode(tokens[:max_tokens])
+
+    used = 0
+    for m in _PIECE_PATTERN.finditer(text):
+        used += _estimate_piece(m.group())
+        if used > max_tokens:
+            return text[:m.start()].rstrip()
+    return text
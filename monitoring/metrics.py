@@ -0,0 +1,88 @@
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+from prometheus_client import Counter, Gauge, Histogram
+
+load_dotenv()
+
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "false").lower() == "true"
+# /metrics is off unless enabled; with a token set, scrapers must send it as a bearer token
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").lower() == "true"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+PENDING_COUNT_TTL = int(os.getenv("PENDING_COUNT_TTL", 30))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+REQUEST_SECONDS = Histogram(
+    "rag_request_seconds",
+    "HTTP request latency until the response headers are sent",
+    ["endpoint", "method", "status"],
+    buckets=LATENCY_BUCKETS
+)
+STAGE_SECONDS = Histogram(
+    "rag_stage_seconds",
+    "Latency of one stage of a request or background job",
+    ["stage"],
+    buckets=LATENCY_BUCKETS
+)
+LLM_TOKENS = Counter(
+    "rag_llm_tokens_total",
+    "Tokens sent to and generated by the LLM",
+    ["model", "operation", "kind"]
+)
+CHUNKS_EMBEDDED = Counter(
+    "rag_chunks_embedded_total",
+    "Chunks embedded and upserted into the vector index"
+)
+INGESTION_JOBS = Gauge(
+    "rag_ingestion_jobs",
+    "Ingestion jobs queued or running in this process"
+)
+
+# Stages timed while handling a request, for the Server-Timing header.
+# Executors copy the context, so stages run on worker threads land here too.
+_trace = contextvars.ContextVar("trace", default=None)
+
+
+def start_trace():
+    trace = []
+    _trace.set(trace)
+    return trace
+
+
+def observe_stage(stage, seconds):
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    trace = _trace.get()
+    if trace is not None:
+        trace.append((stage, seconds))
+
+
+@contextmanager
+def span(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
+
+def record_llm_usage(usage, operation):
+    if not usage:
+        return
+    LLM_TOKENS.labels(usage["model"], operation, "input").inc(usage["input_tokens"])
+    LLM_TOKENS.labels(usage["model"], operation, "output").inc(usage["output_tokens"])
+
+
+def server_timing(trace, total_seconds):
+    durations = {}
+    for stage, seconds in trace:
+        durations[stage] = durations.get(stage, 0.0) + seconds
+    durations["total"] = total_seconds
+
+    return ", ".join(
+        f"{stage};dur={round(seconds * 1000, 2)}"
+        for stage, seconds in durations.items()
+    )
@@ -0,0 +1,133 @@
+import hmac
+import threading
+import time
+
+from flask import Blueprint, Response, abort, g, request
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from chat.summaries import conversation_summary_store
+from database.mongo import chunks_collection
+from database.write_buffer import write_buffer
+from embeddings.allowed_documents import allowed_documents
+from embeddings.embedding_cache import embedding_cache
+from llm.answer_cache import answer_cache
+from monitoring.metrics import (
+    METRICS_ENABLED,
+    METRICS_TOKEN,
+    PENDING_COUNT_TTL,
+    REQUEST_SECONDS,
+    SERVER_TIMING_ENABLED,
+    server_timing,
+    start_trace
+)
+
+
+metrics_bp = Blueprint("metrics", __name__)
+
+
+# Caches and the write buffer already keep their own counters; they are
+# read at scrape time rather than mirrored on every lookup. The unembedded
+# chunk count needs Mongo, so it is refreshed off the scrape and the last
+# known value is reported.
+class StatsCollector:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = None
+        self._pending_at = 0.0
+        self._refreshing = False
+
+    # Registering would otherwise call collect() to find the metric names
+    def describe(self):
+        return []
+
+    def _refresh_pending(self):
+        try:
+            pending = chunks_collection.count_documents({"embedded": False}, maxTimeMS=1000)
+        except Exception as e:
+            print("Counting unembedded chunks failed:", e)
+            pending = None
+
+        with self._lock:
+            if pending is not None:
+                self._pending = pending
+            self._pending_at = time.monotonic()
+            self._refreshing = False
+
+    def pending_embedding(self):
+        with self._lock:
+            if not self._refreshing and time.monotonic() - self._pending_at >= PENDING_COUNT_TTL:
+                self._refreshing = True
+                threading.Thread(target=self._refresh_pending, name="metrics-pending", daemon=True).start()
+            return self._pending
+
+    def collect(self):
+        caches = {
+            "allowed_documents": allowed_documents,
+            "answers": answer_cache,
+            "embeddings": embedding_cache,
+            "conversation_summaries": conversation_summary_store
+        }
+
+        lookups = CounterMetricFamily("rag_cache_lookups", "Cache lookups by result", labels=["cache", "result"])
+        entries = GaugeMetricFamily("rag_cache_entries", "Entries held by each cache", labels=["cache"])
+        for name, cache in caches.items():
+            if cache is None:
+                continue
+            stats = cache.stats()
+            lookups.add_metric([name, "hit"], stats["hits"])
+            lookups.add_metric([name, "miss"], stats["misses"])
+            entries.add_metric([name], stats["entries"])
+        yield lookups
+        yield entries
+
+        stats = write_buffer.stats()
+        if stats is not None:
+            yield GaugeMetricFamily("rag_write_buffer_depth", "Writes waiting in the write buffer", value=stats["queue_depth"])
+            yield CounterMetricFamily("rag_write_buffer_written", "Buffered writes flushed to Mongo", value=stats["written"])
+            yield CounterMetricFamily("rag_write_buffer_dropped", "Buffered writes given up on", value=stats["dropped"])
+
+        pending = self.pending_embedding()
+        if pending is not None:
+            yield GaugeMetricFamily("rag_chunks_pending_embedding", "Chunks waiting to be embedded", value=pending)
+
+
+REGISTRY.register(StatsCollector())
+
+
+@metrics_bp.route("/metrics", methods=["GET"])
+def metrics():
+    if not METRICS_ENABLED:
+        abort(404)
+    if METRICS_TOKEN:
+        supplied = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(supplied.encode(), f"Bearer {METRICS_TOKEN}".encode()):
+            return Response("Unauthorized\n", status=401, headers={"WWW-Authenticate": "Bearer"})
+    return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
+
+
+def _start_request():
+    g.request_started = time.perf_counter()
+    g.trace = start_trace()
+
+
+# Streamed responses are timed until their headers are sent; the stream's
+# own stages are still recorded in rag_stage_seconds.
+def _finish_request(response):
+    started = g.pop("request_started", None)
+    if started is None:
+        return response
+
+    elapsed = time.perf_counter() - started
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    REQUEST_SECONDS.labels(endpoint, request.method, response.status_code).observe(elapsed)
+
+    if SERVER_TIMING_ENABLED:
+        response.headers["Server-Timing"] = server_timing(g.trace, elapsed)
+
+    return response
+
+
+def instrument_app(app):
+    app.before_request(_start_request)
+    app.after_request(_finish_request)